@@ -34,11 +34,63 @@ def main():
         default=10,
         help="Number of trees for Annoy index (default: 10)",
     )
+    parser.add_argument(
+        "--search-k",
+        type=int,
+        default=-1,
+        help="Nodes inspected per test query, -1 for trees * k (default: -1)",
+    )
+    parser.add_argument(
+        "--n-jobs",
+        type=int,
+        default=-1,
+        help="Threads used to build Annoy trees, -1 for all cores (default: -1)",
+    )
+    parser.add_argument(
+        "--on-disk",
+        action="store_true",
+        help="Build the Annoy index directly on disk instead of in memory",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes for parsing log files; 1 uses threads (default: 1)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=64,
+        help="Number of request texts embedded per batch (default: 64)",
+    )
+    parser.add_argument(
+        "--device",
+        type=str,
+        default=None,
+        help="Torch device for the embedding model, e.g. mps or cpu (default: auto)",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["torch", "onnx", "openvino"],
+        default="torch",
+        help="Inference backend for the embedding model (default: torch)",
+    )
+    parser.add_argument(
+        "--model-file",
+        type=str,
+        default=None,
+        help="Model file for the onnx/openvino backends, e.g. onnx/model_qint8_arm64.onnx",
+    )
     parser.add_argument(
         "--force",
         action="store_true",
         help="Force rebuild even if index exists",
     )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Update an existing index with logs added since it was built",
+    )
 
     args = parser.parse_args()
 
@@ -54,19 +106,30 @@ def main():
         recordings_dir=args.recordings_dir,
         model_name=args.model,
         n_trees=args.trees,
+        device=args.device,
+        backend=args.backend,
+        model_file=args.model_file,
+        n_jobs=args.n_jobs,
+        on_disk=args.on_disk,
+        search_k=args.search_k,
     )
 
     # Check if index exists
-    if vector_db.index_file.exists() and not args.force:
+    if vector_db.index_file.exists() and not (args.force or args.incremental):
         print(f"\nIndex already exists at: {vector_db.index_file}")
-        print("Use --force to rebuild")
+        print("Use --force to rebuild or --incremental to add new logs")
         sys.exit(0)
 
     # Build index
     print(f"\nBuilding index from logs in: {recordings_path}")
     print("-" * 60)
 
-    num_indexed = vector_db.build_index_from_logs(verbose=True)
+    num_indexed = vector_db.build_index_from_logs(
+        verbose=True,
+        jobs=args.jobs,
+        batch_size=args.batch_size,
+        incremental=args.incremental and not args.force,
+    )
 
     if num_indexed == 0:
         print("\nNo valid action logs found to index")
@@ -90,7 +153,7 @@ def main():
 
     # Get first request text from metadata to test
     if vector_db.metadata:
-        sample_request = list(vector_db.metadata.values())[0]["request_text"]
+        sample_request = next(iter(vector_db.metadata.values()))["request_text"]
         print(f"\nQuery: '{sample_request}'")
 
         results = vector_db.query_similar(sample_request, k=3, min_similarity=0.0)
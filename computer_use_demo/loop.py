@@ -313,7 +313,7 @@ def _make_api_tool_result(
                     "type": "image",
                     "source": {
                         "type": "base64",
-                        "media_type": "image/png",
+                        "media_type": _image_media_type(result.base64_image),
                         "data": result.base64_image,
                     },
                 }
@@ -326,6 +326,11 @@ def _make_api_tool_result(
     }
 
 
+def _image_media_type(base64_image: str) -> str:
+    """Tell JPEG from PNG screenshots by the base64 of their magic bytes."""
+    return "image/jpeg" if base64_image.startswith("/9j/") else "image/png"
+
+
 def _maybe_prepend_system_tool_result(result: ToolResult, result_text: str):
     if result.system:
         result_text = f"<system>{result.system}</system>\n{result_text}"
@@ -5,7 +5,9 @@ Entrypoint for streamlit, see https://docs.streamlit.io/
 import asyncio
 import base64
 import os
+import stat
 import subprocess
+import threading
 import traceback
 from contextlib import contextmanager
 from dataclasses import dataclass
@@ -33,6 +35,14 @@ from computer_use_demo.tools import ToolResult, ToolVersion
 from computer_use_demo.action_recorder import ActionRecorder
 from computer_use_demo.vector_db import ActionVectorDB
 
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+# e.g. EMBEDDING_BACKEND=onnx EMBEDDING_MODEL_FILE=onnx/model_qint8_arm64.onnx
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_MODEL_FILE = os.getenv("EMBEDDING_MODEL_FILE")
+
+PROVIDER_OPTIONS = [option.value for option in APIProvider]
+TOOL_VERSIONS = get_args(ToolVersion)
+
 PROVIDER_TO_DEFAULT_MODEL_NAME: dict[APIProvider, str] = {
     APIProvider.ANTHROPIC: "claude-sonnet-4-5-20250929",
     APIProvider.BEDROCK: "anthropic.claude-3-5-sonnet-20241022-v2:0",
@@ -95,6 +105,10 @@ MODEL_TO_MODEL_CONF: dict[str, ModelConfig] = {
 
 CONFIG_DIR = PosixPath("~/.anthropic").expanduser()
 API_KEY_FILE = CONFIG_DIR / "api_key"
+# Writes to CONFIG_DIR are coalesced over this window (see save_to_storage)
+STORAGE_WRITE_DELAY = 0.5
+# How long a Bedrock/Vertex credential check is reused (see validate_auth)
+AUTH_CHECK_TTL = timedelta(seconds=30)
 STREAMLIT_STYLE = """
 <style>
     /* Highlight the stop button in red */
@@ -116,6 +130,7 @@ STREAMLIT_STYLE = """
 WARNING_TEXT = "⚠️ Security Alert: Never provide access to sensitive accounts or data, as malicious web content can hijack Claude's behavior"
 INTERRUPT_TEXT = "(user stopped or interrupted and wrote the following)"
 INTERRUPT_TOOL_ERROR = "human stopped or interrupted tool execution"
+INTERRUPT_TEXT_BLOCK = BetaTextBlockParam(type="text", text=INTERRUPT_TEXT)
 
 
 class Sender(StrEnum):
@@ -124,17 +139,50 @@ class Sender(StrEnum):
     TOOL = "tool"
 
 
+@st.cache_resource(show_spinner=False)
+def _load_embedding_model(model_name: str = EMBEDDING_MODEL_NAME):
+    """Load the sentence-transformer model once per process, shared by all sessions."""
+    from sentence_transformers import SentenceTransformer
+
+    return SentenceTransformer(
+        model_name,
+        backend=EMBEDDING_BACKEND,
+        model_kwargs={"file_name": EMBEDDING_MODEL_FILE} if EMBEDDING_MODEL_FILE else None,
+    )
+
+
+@st.cache_data(max_entries=512, show_spinner=False)
+def _embed_query(text: str):
+    """Embed a user message, memoized across reruns and sessions."""
+    return _load_embedding_model(EMBEDDING_MODEL_NAME).encode(
+        text, normalize_embeddings=True
+    )
+
+
+def _query_similar_task(vector_db: ActionVectorDB, text: str):
+    """
+    Find the closest past task for a user message. Blocking (the embedding is
+    a model forward pass on a cache miss), so callers run it in a thread.
+    """
+    return vector_db.query_similar(
+        request_text=text,
+        k=1,
+        min_similarity=0.3,
+        query_embedding=_embed_query(text),
+    )
+
+
 def setup_state():
     if "messages" not in st.session_state:
         st.session_state.messages = []
     if "api_key" not in st.session_state:
-        # Try to load API key from file first, then environment
-        st.session_state.api_key = load_from_storage("api_key") or os.getenv(
-            "ANTHROPIC_API_KEY", ""
+        # Use the environment if it provides a key, otherwise the saved file
+        st.session_state.api_key = (
+            os.getenv("ANTHROPIC_API_KEY") or load_from_storage("api_key") or ""
         )
     if "provider" not in st.session_state:
-        st.session_state.provider = (
-            os.getenv("API_PROVIDER", "anthropic") or APIProvider.ANTHROPIC
+        st.session_state.provider = APIProvider(
+            os.getenv("API_PROVIDER") or APIProvider.ANTHROPIC
         )
     if "provider_radio" not in st.session_state:
         st.session_state.provider_radio = st.session_state.provider
@@ -146,6 +194,9 @@ def setup_state():
         st.session_state.responses = {}
     if "tools" not in st.session_state:
         st.session_state.tools = {}
+    if "tool_use_ids_by_msg" not in st.session_state:
+        # message index -> ids of the tool_use blocks in that message
+        st.session_state.tool_use_ids_by_msg = {}
     if "only_n_most_recent_images" not in st.session_state:
         st.session_state.only_n_most_recent_images = 3
     if "custom_system_prompt" not in st.session_state:
@@ -160,45 +211,47 @@ def setup_state():
         st.session_state.action_recorder = ActionRecorder()
     if "record_actions_pending" not in st.session_state:
         st.session_state.record_actions_pending = False
+    if "last_queried_msg_hash" not in st.session_state:
+        st.session_state.last_queried_msg_hash = None
     if "vector_db_status" not in st.session_state:
         st.session_state.vector_db_status = None
+    if "vector_db_ready" not in st.session_state:
+        st.session_state.vector_db_ready = False
     if "vector_db" not in st.session_state:
         # Initialize VectorDB and try to load existing index
-        st.session_state.vector_db = ActionVectorDB()
-        if st.session_state.vector_db.load_index():
-            # Successfully loaded existing index
-            count = st.session_state.vector_db.next_id
-            st.session_state.vector_db_status = {
-                "type": "loaded",
-                "count": count,
-            }
-        else:
-            # If no index exists, build one from existing logs
-            try:
-                count = st.session_state.vector_db.build_index_from_logs(verbose=False)
-                if count > 0:
-                    st.session_state.vector_db.save_index()
-                    st.session_state.vector_db_status = {
-                        "type": "built",
-                        "count": count,
-                    }
-                else:
-                    st.session_state.vector_db_status = {
-                        "type": "empty",
-                        "count": 0,
-                    }
-            except Exception as e:
+        st.session_state.vector_db = ActionVectorDB(
+            model_name=EMBEDDING_MODEL_NAME,
+            model=_load_embedding_model(EMBEDDING_MODEL_NAME),
+        )
+        st.session_state.vector_db_ready = True
+        # Only read the saved metadata here; the Annoy index is loaded, or built
+        # from the logs, on the first query (see ActionVectorDB.ensure_index)
+        try:
+            if st.session_state.vector_db.load_metadata():
                 st.session_state.vector_db_status = {
-                    "type": "error",
-                    "message": str(e),
+                    "type": "loaded",
+                    "count": st.session_state.vector_db.next_id,
                 }
-                print(f"Failed to build vector index: {e}")
+            elif st.session_state.vector_db.has_logs():
+                st.session_state.vector_db_status = {
+                    "type": "deferred",
+                    "count": 0,
+                }
+            else:
+                st.session_state.vector_db_status = {
+                    "type": "empty",
+                    "count": 0,
+                }
+        except Exception as e:
+            st.session_state.vector_db_status = {
+                "type": "error",
+                "message": str(e),
+            }
+            print(f"Failed to load vector index: {e}")
 
 
 def _reset_model():
-    st.session_state.model = PROVIDER_TO_DEFAULT_MODEL_NAME[
-        cast(APIProvider, st.session_state.provider)
-    ]
+    st.session_state.model = PROVIDER_TO_DEFAULT_MODEL_NAME[st.session_state.provider]
     _reset_model_conf()
 
 
@@ -239,86 +292,15 @@ async def main():
             st.success(f"✓ Vector database loaded: {status['count']} action{'s' if status['count'] != 1 else ''} indexed")
         elif status["type"] == "built":
             st.success(f"✓ Vector database built: {status['count']} action{'s' if status['count'] != 1 else ''} indexed from logs")
+        elif status["type"] == "deferred":
+            st.info("ℹ Vector database will be built from action logs on first use")
         elif status["type"] == "empty":
             st.info("ℹ Vector database initialized: No action logs found yet")
         elif status["type"] == "error":
             st.warning(f"⚠ Vector database error: {status['message']}")
 
     with st.sidebar:
-
-        def _reset_api_provider():
-            if st.session_state.provider_radio != st.session_state.provider:
-                _reset_model()
-                st.session_state.provider = st.session_state.provider_radio
-                st.session_state.auth_validated = False
-
-        provider_options = [option.value for option in APIProvider]
-        st.radio(
-            "API Provider",
-            options=provider_options,
-            key="provider_radio",
-            format_func=lambda x: x.title(),
-            on_change=_reset_api_provider,
-        )
-
-        st.text_input("Model", key="model", on_change=_reset_model_conf)
-
-        if st.session_state.provider == APIProvider.ANTHROPIC:
-            st.text_input(
-                "Claude API Key",
-                type="password",
-                key="api_key",
-                on_change=lambda: save_to_storage("api_key", st.session_state.api_key),
-            )
-
-        st.number_input(
-            "Only send N most recent images",
-            min_value=0,
-            key="only_n_most_recent_images",
-            help="To decrease the total tokens sent, remove older screenshots from the conversation",
-        )
-        st.text_area(
-            "Custom System Prompt Suffix",
-            key="custom_system_prompt",
-            help="Additional instructions to append to the system prompt. see computer_use_demo/loop.py for the base system prompt.",
-            on_change=lambda: save_to_storage(
-                "system_prompt", st.session_state.custom_system_prompt
-            ),
-        )
-        st.checkbox("Hide screenshots", key="hide_images")
-        st.checkbox(
-            "Enable token-efficient tools beta", key="token_efficient_tools_beta"
-        )
-        versions = get_args(ToolVersion)
-        st.radio(
-            "Tool Versions",
-            key="tool_versions",
-            options=versions,
-            index=versions.index(st.session_state.tool_version),
-            on_change=lambda: setattr(
-                st.session_state, "tool_version", st.session_state.tool_versions
-            ),
-        )
-
-        st.number_input("Max Output Tokens", key="output_tokens", step=1)
-
-        st.checkbox("Thinking Enabled", key="thinking", value=False)
-        st.number_input(
-            "Thinking Budget",
-            key="thinking_budget",
-            max_value=st.session_state.max_output_tokens,
-            step=1,
-            disabled=not st.session_state.thinking,
-        )
-
-        if st.button("Reset", type="primary"):
-            with st.spinner("Resetting..."):
-                st.session_state.clear()
-                st.rerun()
-
-        if st.button("Record Actions"):
-            st.session_state.record_actions_pending = True
-            st.rerun()
+        _render_sidebar()
 
     if not st.session_state.auth_validated:
         if auth_error := validate_auth(
@@ -341,22 +323,7 @@ async def main():
 
     with chat:
         # render past chats
-        for message in st.session_state.messages:
-            if isinstance(message["content"], str):
-                _render_message(message["role"], message["content"])
-            elif isinstance(message["content"], list):
-                for block in message["content"]:
-                    # the tool result we send back to the Claude API isn't sufficient to render all details,
-                    # so we store the tool use responses
-                    if isinstance(block, dict) and block["type"] == "tool_result":
-                        _render_message(
-                            Sender.TOOL, st.session_state.tools[block["tool_use_id"]]
-                        )
-                    else:
-                        _render_message(
-                            message["role"],
-                            cast(BetaContentBlockParam | ToolResult, block),
-                        )
+        _render_chat_transcript()
 
         # render past http exchanges
         for identity, (request, response) in st.session_state.responses.items():
@@ -386,25 +353,38 @@ async def main():
             # we don't have a user message to respond to, exit early
             return
 
-        # Query VectorDB for similar past requests
-        if new_message and hasattr(st.session_state, "vector_db"):
+        # Query VectorDB for similar past requests, once per new message
+        message_hash = hash(new_message) if new_message else None
+        if (
+            new_message
+            and message_hash != st.session_state.last_queried_msg_hash
+            and st.session_state.vector_db_ready
+            and (
+                st.session_state.vector_db.next_id > 0
+                or not st.session_state.vector_db.index_loaded
+            )
+        ):
+            st.session_state.last_queried_msg_hash = message_hash
             try:
-                similar_requests = st.session_state.vector_db.query_similar(
-                    request_text=new_message,
-                    k=1,
-                    min_similarity=0.3,
+                # Embed and search (and, on first use, load or build the index)
+                # off the event loop
+                similar_requests = await asyncio.to_thread(
+                    _query_similar_task, st.session_state.vector_db, new_message
                 )
+                if st.session_state.vector_db_status["type"] == "deferred":
+                    st.session_state.vector_db_status = {
+                        "type": "built",
+                        "count": st.session_state.vector_db.next_id,
+                    }
 
                 if similar_requests:
                     best_match = similar_requests[0]
-                    narrative = best_match["narrative"]
 
                     # Inject narrative as a text block
-                    narrative_content = (
-                        f"Reference: I found a similar past task.\n\n"
-                        f"Previous request: \"{best_match['request_text']}\"\n\n"
-                        f"Here's how it was successfully completed:\n\n{narrative}\n\n"
-                        f"I should consider this approach as a reference while adapting it to the current task."
+                    narrative_content = _format_narrative(
+                        best_match["id"],
+                        best_match["request_text"],
+                        best_match["narrative"],
                     )
 
                     st.session_state.messages.append({
@@ -427,7 +407,7 @@ async def main():
                 model=st.session_state.model,
                 provider=st.session_state.provider,
                 messages=st.session_state.messages,
-                output_callback=partial(_render_message, Sender.BOT),
+                output_callback=_output_callback,
                 tool_output_callback=partial(
                     _tool_output_callback, tool_state=st.session_state.tools
                 ),
@@ -447,18 +427,161 @@ async def main():
             )
 
 
+@st.fragment
+def _render_sidebar():
+    """
+    Render the settings sidebar. Its widgets only write to session_state, which
+    main() reads on the next full run, so changing a setting reruns just this
+    fragment instead of re-rendering the chat transcript.
+    """
+
+    def _reset_api_provider():
+        if st.session_state.provider_radio != st.session_state.provider:
+            _reset_model()
+            st.session_state.provider = APIProvider(st.session_state.provider_radio)
+            st.session_state.auth_validated = False
+            st.session_state.provider_changed = True
+
+    st.radio(
+        "API Provider",
+        options=PROVIDER_OPTIONS,
+        key="provider_radio",
+        format_func=lambda x: x.title(),
+        on_change=_reset_api_provider,
+    )
+
+    st.text_input("Model", key="model", on_change=_reset_model_conf)
+
+    if st.session_state.provider == APIProvider.ANTHROPIC:
+        st.text_input(
+            "Claude API Key",
+            type="password",
+            key="api_key",
+            on_change=lambda: save_to_storage("api_key", st.session_state.api_key),
+        )
+
+    st.number_input(
+        "Only send N most recent images",
+        min_value=0,
+        key="only_n_most_recent_images",
+        help="To decrease the total tokens sent, remove older screenshots from the conversation",
+    )
+    st.text_area(
+        "Custom System Prompt Suffix",
+        key="custom_system_prompt",
+        help="Additional instructions to append to the system prompt. see computer_use_demo/loop.py for the base system prompt.",
+        on_change=lambda: save_to_storage(
+            "system_prompt", st.session_state.custom_system_prompt
+        ),
+    )
+    st.checkbox("Hide screenshots", key="hide_images")
+    st.checkbox(
+        "Enable token-efficient tools beta", key="token_efficient_tools_beta"
+    )
+    st.radio(
+        "Tool Versions",
+        key="tool_versions",
+        options=TOOL_VERSIONS,
+        index=TOOL_VERSIONS.index(st.session_state.tool_version),
+        on_change=lambda: setattr(
+            st.session_state, "tool_version", st.session_state.tool_versions
+        ),
+    )
+
+    st.number_input("Max Output Tokens", key="output_tokens", step=1)
+
+    st.checkbox("Thinking Enabled", key="thinking", value=False)
+    st.number_input(
+        "Thinking Budget",
+        key="thinking_budget",
+        max_value=st.session_state.max_output_tokens,
+        step=1,
+        disabled=not st.session_state.thinking,
+    )
+
+    if st.button("Reset", type="primary"):
+        with st.spinner("Resetting..."):
+            st.session_state.clear()
+            st.rerun(scope="app")
+
+    if st.button("Record Actions"):
+        st.session_state.record_actions_pending = True
+        st.rerun(scope="app")
+
+    # Callbacks can't rerun the app themselves; a new provider needs the auth
+    # check in main(), so finish the fragment run with a full one
+    if st.session_state.pop("provider_changed", False):
+        st.rerun(scope="app")
+
+
+def _render_chat_transcript():
+    """Render the past chat messages."""
+    for message in st.session_state.messages:
+        if isinstance(message["content"], str):
+            _render_message(message["role"], message["content"])
+        elif isinstance(message["content"], list):
+            # adjacent text blocks are rendered together as one chat message
+            text_run: list[str] = []
+            for block in message["content"]:
+                if isinstance(block, dict) and block["type"] == "text":
+                    text_run.append(block["text"])
+                    continue
+                if text_run:
+                    _render_text_run(message["role"], text_run)
+                    text_run = []
+                # the tool result we send back to the Claude API isn't sufficient to render all details,
+                # so we store the tool use responses
+                if isinstance(block, dict) and block["type"] == "tool_result":
+                    _render_message(
+                        Sender.TOOL, st.session_state.tools[block["tool_use_id"]]
+                    )
+                else:
+                    _render_message(
+                        message["role"],
+                        cast(BetaContentBlockParam | ToolResult, block),
+                    )
+            if text_run:
+                _render_text_run(message["role"], text_run)
+
+
+def _render_text_run(sender: Sender, texts: list[str]):
+    """Render consecutive text blocks of one message as a single markdown element."""
+    with st.chat_message(sender):
+        st.markdown("\n\n".join(texts))
+    for text in texts:
+        st.session_state.action_recorder.record_thinking(text)
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def _decode_image(b64: str) -> bytes:
+    """Decode a base64 screenshot, memoized so reruns don't re-decode it."""
+    return base64.b64decode(b64)
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def _format_narrative(match_id: int, request_text: str, narrative: str) -> str:
+    """Build the reference message injected for a similar past task."""
+    return (
+        f"Reference: I found a similar past task.\n\n"
+        f"Previous request: \"{request_text}\"\n\n"
+        f"Here's how it was successfully completed:\n\n{narrative}\n\n"
+        f"I should consider this approach as a reference while adapting it to the current task."
+    )
+
+
 def maybe_add_interruption_blocks():
     if not st.session_state.in_sampling_loop:
         return []
     # If this function is called while we're in the sampling loop, we can assume that the previous sampling loop was interrupted
     # and we should annotate the conversation with additional context for the model and heal any incomplete tool use calls
     result = []
-    last_message = st.session_state.messages[-1]
-    previous_tool_use_ids = [
-        block["id"] for block in last_message["content"] if block["type"] == "tool_use"
-    ]
+    previous_tool_use_ids = st.session_state.tool_use_ids_by_msg.get(
+        len(st.session_state.messages) - 1, []
+    )
+    # ToolResult is frozen, so every interrupted tool can share one instance
+    interrupted_result = ToolResult(error=INTERRUPT_TOOL_ERROR)
     for tool_use_id in previous_tool_use_ids:
-        st.session_state.tools[tool_use_id] = ToolResult(error=INTERRUPT_TOOL_ERROR)
+        st.session_state.tools[tool_use_id] = interrupted_result
         result.append(
             BetaToolResultBlockParam(
                 tool_use_id=tool_use_id,
@@ -467,7 +590,8 @@ def maybe_add_interruption_blocks():
                 is_error=True,
             )
         )
-    result.append(BetaTextBlockParam(type="text", text=INTERRUPT_TEXT))
+    # copied because prompt caching may add cache_control to the block in place
+    result.append(INTERRUPT_TEXT_BLOCK.copy())
     return result
 
 
@@ -483,26 +607,44 @@ def validate_auth(provider: APIProvider, api_key: str | None):
         if not api_key:
             return "Enter your Claude API key in the sidebar to continue."
     if provider == APIProvider.BEDROCK:
-        import boto3
-
-        if not boto3.Session().get_credentials():
-            return "You must have AWS credentials set up to use the Bedrock API."
+        return _check_bedrock_credentials()
     if provider == APIProvider.VERTEX:
-        import google.auth
-        from google.auth.exceptions import DefaultCredentialsError
-
         if not os.environ.get("CLOUD_ML_REGION"):
             return "Set the CLOUD_ML_REGION environment variable to use the Vertex API."
-        try:
-            google.auth.default(
-                scopes=["https://www.googleapis.com/auth/cloud-platform"],
-            )
-        except DefaultCredentialsError:
-            return "Your google cloud credentials are not set up correctly."
+        return _check_vertex_credentials()
+
+
+# Cloud credential lookups read config files, so reruns reuse the result for a
+# short while; the TTL lets a fixed setup be picked up without a restart.
+@st.cache_data(ttl=AUTH_CHECK_TTL, show_spinner=False)
+def _check_bedrock_credentials() -> str | None:
+    import boto3
+
+    if not boto3.Session().get_credentials():
+        return "You must have AWS credentials set up to use the Bedrock API."
+    return None
+
+
+@st.cache_data(ttl=AUTH_CHECK_TTL, show_spinner=False)
+def _check_vertex_credentials() -> str | None:
+    import google.auth
+    from google.auth.exceptions import DefaultCredentialsError
+
+    try:
+        google.auth.default(
+            scopes=["https://www.googleapis.com/auth/cloud-platform"],
+        )
+    except DefaultCredentialsError:
+        return "Your google cloud credentials are not set up correctly."
+    return None
 
 
 def load_from_storage(filename: str) -> str | None:
     """Load data from a file in the storage directory."""
+    with _pending_writes_lock:
+        pending = _pending_writes.get(filename)
+    if pending is not None:
+        return pending.strip() or None
     try:
         file_path = CONFIG_DIR / filename
         if file_path.exists():
@@ -514,16 +656,53 @@ def load_from_storage(filename: str) -> str | None:
     return None
 
 
+_pending_writes: dict[str, str] = {}
+_pending_writes_lock = threading.Lock()
+_flush_timer: threading.Timer | None = None
+
+
 def save_to_storage(filename: str, data: str) -> None:
-    """Save data to a file in the storage directory."""
+    """
+    Save data to a file in the storage directory.
+
+    The write happens on a timer thread after STORAGE_WRITE_DELAY, so repeated
+    saves (e.g. on_change while typing) only hit the disk once per window.
+    """
+    global _flush_timer
+    with _pending_writes_lock:
+        _pending_writes[filename] = data
+        if _flush_timer is None:
+            _flush_timer = threading.Timer(STORAGE_WRITE_DELAY, _flush_pending_writes)
+            _flush_timer.start()
+
+
+def _flush_pending_writes() -> None:
+    """Write every pending save_to_storage call, latest data per file."""
+    global _flush_timer
+    with _pending_writes_lock:
+        pending = dict(_pending_writes)
+        _pending_writes.clear()
+        _flush_timer = None
+    for filename, data in pending.items():
+        _write_to_storage(filename, data)
+
+
+def _write_to_storage(filename: str, data: str) -> None:
+    """Write data to a file in the storage directory, readable only by the user."""
     try:
         CONFIG_DIR.mkdir(parents=True, exist_ok=True)
         file_path = CONFIG_DIR / filename
+        try:
+            mode = stat.S_IMODE(file_path.stat().st_mode)
+        except FileNotFoundError:
+            mode = None
         file_path.write_text(data)
         # Ensure only user can read/write the file
-        file_path.chmod(0o600)
+        if mode != 0o600:
+            file_path.chmod(0o600)
     except Exception as e:
-        st.write(f"Debug: Error saving {filename}: {e}")
+        # Runs outside the script thread, so st.write isn't available here
+        print(f"Error saving {filename}: {e}")
 
 
 async def _handle_record_actions():
@@ -534,33 +713,27 @@ async def _handle_record_actions():
             return
 
         with st.spinner("Processing and saving actions..."):
-            filepath = await st.session_state.action_recorder.process_and_save(
+            filepath, recording = await st.session_state.action_recorder.process_and_save(
                 api_key=st.session_state.api_key,
             )
             st.success(f"Actions recorded successfully to: {filepath}")
 
             # Update VectorDB with the new recording
-            if hasattr(st.session_state, "vector_db"):
+            if st.session_state.vector_db_ready:
                 try:
-                    import json
-                    from pathlib import Path
-
-                    # Load the saved recording to extract request and narrative
-                    with open(filepath) as f:
-                        recording = json.load(f)
-
-                    request_text = recording.get("request", {}).get("content", {}).get("text")
+                    request_text = recording["request"]["content"].get("text")
                     narrative = recording.get("narrative")
 
                     if request_text and narrative:
-                        # Add to vector index
+                        # Add to vector index; the rebuild and save run in the background
                         st.session_state.vector_db.add_to_index(
                             request_text=request_text,
                             narrative=narrative,
-                            log_file=Path(filepath).name,
+                            log_file=os.path.basename(filepath),
+                            embedding=_embed_query(request_text),
+                            background=True,
+                            save=True,
                         )
-                        # Save the updated index
-                        st.session_state.vector_db.save_index()
                 except Exception as e:
                     print(f"Failed to update vector index: {e}")
 
@@ -587,6 +760,20 @@ def _api_response_callback(
     _render_api_response(request, response, response_id, tab)
 
 
+def _output_callback(block: BetaContentBlockParam):
+    """Handle an assistant content block by indexing its message's tool uses and rendering it."""
+    # sampling_loop appends the full assistant message before emitting its blocks,
+    # so index all of its tool_use ids on the first block
+    msg_index = len(st.session_state.messages) - 1
+    if msg_index not in st.session_state.tool_use_ids_by_msg:
+        st.session_state.tool_use_ids_by_msg[msg_index] = [
+            b["id"]
+            for b in st.session_state.messages[msg_index]["content"]
+            if isinstance(b, dict) and b.get("type") == "tool_use"
+        ]
+    _render_message(Sender.BOT, block)
+
+
 def _tool_output_callback(
     tool_output: ToolResult,
     tool_id: str,
@@ -670,7 +857,7 @@ def _render_message(
             if message.error:
                 st.error(message.error)
             if message.base64_image and not st.session_state.hide_images:
-                st.image(base64.b64decode(message.base64_image))
+                st.image(_decode_image(message.base64_image))
         elif isinstance(message, dict):
             if message["type"] == "text":
                 st.write(message["text"])
@@ -5,23 +5,69 @@ Replaces xdotool-based Linux implementation with native macOS automation.
 
 import asyncio
 import base64
+import functools
+import hashlib
+import importlib.util
+import itertools
 import os
+import re
+import sys
+import time
 from io import BytesIO
 from pathlib import Path
 from enum import StrEnum
+from collections.abc import Iterable
 from typing import Literal, TypedDict, cast, get_args
-from uuid import uuid4
 
 from anthropic.types.beta import BetaToolUnionParam
 
-import pyautogui
 from PIL import Image
 from .base import BaseAnthropicTool, ToolError, ToolResult
 
+
+def _lazy_import(name: str):
+    """Return a module that is only executed on first attribute access."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+# PyAutoGUI connects to the window server on import, so defer that until the
+# tool is actually used
+pyautogui = _lazy_import("pyautogui")
+
+
+@functools.cache
+def _load_quartz():
+    """
+    Import Quartz (installed alongside PyAutoGUI on macOS) on first use, or
+    return None if it is unavailable. Quartz replaces itself in sys.modules
+    while importing, so it can't go through _lazy_import.
+    """
+    try:
+        import Quartz
+    except ImportError:
+        return None
+    return Quartz
+
 OUTPUT_DIR = "/tmp/outputs"
 
 TYPING_DELAY_MS = 0.012  # Convert to seconds for PyAutoGUI
-TYPING_GROUP_SIZE = 50
+
+# Characters per Unicode keyboard event; macOS accepts up to 20 UTF-16 units
+TYPING_CHUNK_SIZE = 10
+# Characters typed as real key presses (virtual key codes) rather than as text
+TYPING_KEYCODES = {"\n": 36, "\t": 48}
+_TYPING_SPLIT_RE = re.compile(r"([\n\t])")
+
+# JPEG encodes far faster and smaller than PNG and reads the same to the model
+SCREENSHOT_JPEG_QUALITY = 80
 
 Action_20241022 = Literal[
     "key",
@@ -76,10 +122,6 @@ class ComputerToolOptions(TypedDict):
     display_number: int | None
 
 
-def chunks(s: str, chunk_size: int) -> list[str]:
-    return [s[i : i + chunk_size] for i in range(0, len(s), chunk_size)]
-
-
 # macOS keyboard mapping from X11/Linux keys to PyAutoGUI keys
 MACOS_KEY_MAPPING = {
     # Modifier keys
@@ -124,9 +166,201 @@ MACOS_KEY_MAPPING = {
 }
 
 
+_translate_key_get = MACOS_KEY_MAPPING.get
+
+
 def translate_key(key: str) -> str:
     """Translate X11/Linux key names to macOS/PyAutoGUI key names."""
-    return MACOS_KEY_MAPPING.get(key, key.lower())
+    return _translate_key_get(key) or key.lower()
+
+
+def _post_click(button: Literal["left", "right", "middle"] = "left", clicks: int = 1):
+    """
+    Click at the current mouse position by posting CGEvents directly, skipping
+    PyAutoGUI's per-call overhead. Falls back to PyAutoGUI without quartz.
+    """
+    quartz = _load_quartz()
+    if quartz is None:
+        pyautogui.click(clicks=clicks, button=button)
+        return
+    if button == "left":
+        down, up, mouse_button = (
+            quartz.kCGEventLeftMouseDown, quartz.kCGEventLeftMouseUp, quartz.kCGMouseButtonLeft
+        )
+    elif button == "right":
+        down, up, mouse_button = (
+            quartz.kCGEventRightMouseDown, quartz.kCGEventRightMouseUp, quartz.kCGMouseButtonRight
+        )
+    else:
+        down, up, mouse_button = (
+            quartz.kCGEventOtherMouseDown, quartz.kCGEventOtherMouseUp, quartz.kCGMouseButtonCenter
+        )
+    position = quartz.CGEventGetLocation(quartz.CGEventCreate(None))
+    # The click state tells apps a double/triple click apart from separate clicks
+    for click_state in range(1, clicks + 1):
+        for event_type in (down, up):
+            event = quartz.CGEventCreateMouseEvent(None, event_type, position, mouse_button)
+            quartz.CGEventSetIntegerValueField(
+                event, quartz.kCGMouseEventClickState, click_state
+            )
+            quartz.CGEventPost(quartz.kCGHIDEventTap, event)
+
+
+# Button and click count for each click action
+CLICK_ACTIONS: dict[str, tuple[Literal["left", "right", "middle"], int]] = {
+    "left_click": ("left", 1),
+    "right_click": ("right", 1),
+    "middle_click": ("middle", 1),
+    "double_click": ("left", 2),
+}
+
+
+def _modified_click(
+    position: tuple[int, int] | None,
+    modifier: str | None,
+    button: Literal["left", "right", "middle"],
+    clicks: int,
+):
+    """Move to position (if given) and click with modifier (if given) held down."""
+    if position is not None:
+        pyautogui.moveTo(*position, duration=0.2)
+    if modifier:
+        pyautogui.keyDown(modifier)
+    try:
+        _post_click(button, clicks)
+    finally:
+        if modifier:
+            pyautogui.keyUp(modifier)
+
+
+def _modified_scroll(
+    position: tuple[int, int] | None,
+    modifier: str | None,
+    direction: ScrollDirection,
+    amount: int,
+):
+    """Move to position (if given) and scroll with modifier (if given) held down."""
+    if position is not None:
+        pyautogui.moveTo(*position, duration=0.2)
+    if modifier:
+        pyautogui.keyDown(modifier)
+    try:
+        # PyAutoGUI uses positive for up/right, negative for down/left
+        if direction == "up":
+            pyautogui.scroll(amount * 10)
+        elif direction == "down":
+            pyautogui.scroll(-amount * 10)
+        elif direction == "left":
+            pyautogui.hscroll(-amount * 10)
+        elif direction == "right":
+            pyautogui.hscroll(amount * 10)
+    finally:
+        if modifier:
+            pyautogui.keyUp(modifier)
+
+
+def _key_down_all(keys: Iterable[str]):
+    for k in keys:
+        pyautogui.keyDown(k)
+
+
+def _key_up_all(keys: Iterable[str]):
+    for k in keys:
+        pyautogui.keyUp(k)
+
+
+def _type_text(text: str):
+    """
+    Type text by posting Unicode keyboard events through Quartz, several
+    characters per event. Unlike pyautogui.write this also types characters
+    that have no key on the layout. Falls back to PyAutoGUI without quartz.
+    """
+    quartz = _load_quartz()
+    if quartz is None:
+        pyautogui.write(text, interval=TYPING_DELAY_MS)
+        return
+    for part in _TYPING_SPLIT_RE.split(text):
+        if not part:
+            continue
+        if part in TYPING_KEYCODES:
+            for key_down in (True, False):
+                event = quartz.CGEventCreateKeyboardEvent(None, TYPING_KEYCODES[part], key_down)
+                quartz.CGEventPost(quartz.kCGHIDEventTap, event)
+            time.sleep(TYPING_DELAY_MS)
+            continue
+        for i in range(0, len(part), TYPING_CHUNK_SIZE):
+            chunk = part[i : i + TYPING_CHUNK_SIZE]
+            length = len(chunk.encode("utf-16-le")) // 2
+            for key_down in (True, False):
+                event = quartz.CGEventCreateKeyboardEvent(None, 0, key_down)
+                quartz.CGEventKeyboardSetUnicodeString(event, length, chunk)
+                quartz.CGEventPost(quartz.kCGHIDEventTap, event)
+            time.sleep(TYPING_DELAY_MS)
+
+
+def _capture_screen(region: tuple[int, int, int, int] | None = None) -> Image.Image:
+    """
+    Capture the main display (or an (x, y, width, height) region of it, in
+    points) in memory with CoreGraphics.
+
+    PyAutoGUI shells out to `screencapture` and reads a temp PNG back; it is
+    only used when Quartz is unavailable or the capture is denied.
+    """
+    quartz = _load_quartz()
+    if quartz is None:
+        return pyautogui.screenshot(region=region)
+    if region is None:
+        bounds = quartz.CGDisplayBounds(quartz.CGMainDisplayID())
+    else:
+        bounds = quartz.CGRectMake(*region)
+    image_ref = quartz.CGWindowListCreateImage(
+        bounds,
+        quartz.kCGWindowListOptionOnScreenOnly,
+        quartz.kCGNullWindowID,
+        quartz.kCGWindowImageDefault,
+    )
+    if image_ref is None:
+        return pyautogui.screenshot(region=region)
+    width = quartz.CGImageGetWidth(image_ref)
+    height = quartz.CGImageGetHeight(image_ref)
+    bytes_per_row = quartz.CGImageGetBytesPerRow(image_ref)
+    data = quartz.CGDataProviderCopyData(quartz.CGImageGetDataProvider(image_ref))
+    # Rows may be padded past width * 4, so pass the stride explicitly
+    return Image.frombuffer(
+        "RGBA", (width, height), data, "raw", "BGRA", bytes_per_row, 1
+    )
+
+
+def _downscale(image: Image.Image, width: int, height: int) -> Image.Image:
+    """
+    Resize a screenshot for the model. BOX is exact for whole-number ratios
+    (e.g. Retina to half size) and BILINEAR is close enough otherwise, both at
+    a fraction of LANCZOS's cost.
+    """
+    if image.width % width == 0 and image.height % height == 0:
+        resample = Image.Resampling.BOX
+    else:
+        resample = Image.Resampling.BILINEAR
+    return image.resize((width, height), resample)
+
+
+def _encode_jpeg(image: Image.Image, fp: BytesIO):
+    """Encode a screenshot as JPEG; JPEG has no alpha, so drop it first."""
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    image.save(fp, format="JPEG", quality=SCREENSHOT_JPEG_QUALITY, optimize=False)
+
+
+_screenshot_counter = itertools.count()
+
+
+def _save_screenshot(data: bytes | memoryview):
+    """Write encoded screenshot bytes to a uniquely named file in OUTPUT_DIR."""
+    output_dir = Path(OUTPUT_DIR)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    # The pid keeps names from separate runs apart; the counter orders them within one
+    path = output_dir / f"screenshot_{os.getpid()}_{next(_screenshot_counter)}.jpg"
+    path.write_bytes(data)
 
 
 class BaseComputerToolMacOS:
@@ -140,7 +374,11 @@ class BaseComputerToolMacOS:
     height: int
     display_num: int | None
 
+    # Longest wait for the screen to settle after an action, and how often to check
     _screenshot_delay = 1.0
+    _settle_poll_interval = 0.05
+    # Side of the square crop, at the screen's center, compared between checks
+    _settle_crop_size = 256
     _scaling_enabled = True
 
     @property
@@ -170,9 +408,12 @@ class BaseComputerToolMacOS:
         # Display number not used on macOS (no X11)
         self.display_num = None
 
+        # The screen size is fixed, so pick the scaling target once
+        self._scaling_factors = self._compute_scaling_factors()
+
         # Configure PyAutoGUI
         pyautogui.FAILSAFE = False  # Disable failsafe for automation
-        pyautogui.PAUSE = 0.01  # Small pause between PyAutoGUI calls
+        pyautogui.PAUSE = 0  # Events are posted in order; no pause needed between calls
 
     async def __call__(
         self,
@@ -216,15 +457,12 @@ class BaseComputerToolMacOS:
                     raise ToolError(f"Failed to press keys {keys}: {str(e)}")
 
             elif action == "type":
-                results: list[ToolResult] = []
-                for chunk in chunks(text, TYPING_GROUP_SIZE):
-                    await asyncio.to_thread(pyautogui.write, chunk, interval=TYPING_DELAY_MS)
-                    results.append(ToolResult(output=f"Typed: {chunk}"))
+                await asyncio.to_thread(_type_text, text)
 
-                await asyncio.sleep(self._screenshot_delay)
+                await self._wait_for_screen_to_settle()
                 screenshot_base64 = (await self.screenshot()).base64_image
                 return ToolResult(
-                    output="".join(result.output or "" for result in results),
+                    output=f"Typed: {text}",
                     base64_image=screenshot_base64,
                 )
 
@@ -248,24 +486,49 @@ class BaseComputerToolMacOS:
                 x, y = self.scale_coordinates(ScalingSource.COMPUTER, pos[0], pos[1])
                 return ToolResult(output=f"X={x},Y={y}")
             elif action == "left_click":
-                await asyncio.to_thread(pyautogui.click)
-                await asyncio.sleep(self._screenshot_delay)
+                await asyncio.to_thread(_post_click)
+                await self._wait_for_screen_to_settle()
                 return await self.screenshot()
             elif action == "right_click":
-                await asyncio.to_thread(pyautogui.rightClick)
-                await asyncio.sleep(self._screenshot_delay)
+                await asyncio.to_thread(_post_click, "right")
+                await self._wait_for_screen_to_settle()
                 return await self.screenshot()
             elif action == "middle_click":
-                await asyncio.to_thread(pyautogui.middleClick)
-                await asyncio.sleep(self._screenshot_delay)
+                await asyncio.to_thread(_post_click, "middle")
+                await self._wait_for_screen_to_settle()
                 return await self.screenshot()
             elif action == "double_click":
-                await asyncio.to_thread(pyautogui.doubleClick)
-                await asyncio.sleep(self._screenshot_delay)
+                await asyncio.to_thread(_post_click, "left", 2)
+                await self._wait_for_screen_to_settle()
                 return await self.screenshot()
 
         raise ToolError(f"Invalid action: {action}")
 
+    async def _wait_for_screen_to_settle(self):
+        """
+        Wait until the screen stops changing after an action, for at most
+        _screenshot_delay seconds, by comparing hashes of a small crop between
+        polls. Static screens return after a couple of polls instead of
+        always sleeping the full delay.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self._screenshot_delay
+        size = self._settle_crop_size
+        region = (
+            max(0, (self.width - size) // 2),
+            max(0, (self.height - size) // 2),
+            min(size, self.width),
+            min(size, self.height),
+        )
+        previous = None
+        while loop.time() < deadline:
+            await asyncio.sleep(self._settle_poll_interval)
+            crop = await asyncio.to_thread(_capture_screen, region)
+            digest = hashlib.blake2b(crop.tobytes(), digest_size=16).digest()
+            if digest == previous:
+                return
+            previous = digest
+
     def validate_and_get_coordinates(self, coordinate: tuple[int, int] | None = None):
         if not isinstance(coordinate, list) or len(coordinate) != 2:
             raise ToolError(f"{coordinate} must be a tuple of length 2")
@@ -276,12 +539,8 @@ class BaseComputerToolMacOS:
 
     async def screenshot(self):
         """Take a screenshot of the current screen and return the base64 encoded image."""
-        output_dir = Path(OUTPUT_DIR)
-        output_dir.mkdir(parents=True, exist_ok=True)
-        path = output_dir / f"screenshot_{uuid4().hex}.png"
-
-        # Take screenshot using PyAutoGUI
-        screenshot = await asyncio.to_thread(pyautogui.screenshot)
+        # Take screenshot
+        screenshot = await asyncio.to_thread(_capture_screen)
 
         # Scale if needed
         if self._scaling_enabled:
@@ -290,25 +549,25 @@ class BaseComputerToolMacOS:
             )
             # Only resize if scaling is actually needed
             if target_width != self.width or target_height != self.height:
-                screenshot = screenshot.resize(
-                    (target_width, target_height),
-                    Image.Resampling.LANCZOS
+                screenshot = await asyncio.to_thread(
+                    _downscale, screenshot, target_width, target_height
                 )
 
-        # Save screenshot
-        await asyncio.to_thread(screenshot.save, path, "PNG")
-
-        # Convert to base64
         buffered = BytesIO()
-        await asyncio.to_thread(screenshot.save, buffered, format="PNG")
-        img_base64 = base64.b64encode(buffered.getvalue()).decode()
+        await asyncio.to_thread(_encode_jpeg, screenshot, buffered)
+        # A view of the encoded bytes, so they aren't copied out of the buffer
+        data = buffered.getbuffer()
+
+        # Keep a copy on disk only when asked to, for debugging
+        if os.getenv("SAVE_SCREENSHOTS"):
+            await asyncio.to_thread(_save_screenshot, data)
+
+        img_base64 = base64.b64encode(data).decode("ascii")
 
         return ToolResult(base64_image=img_base64)
 
-    def scale_coordinates(self, source: ScalingSource, x: int, y: int):
-        """Scale coordinates to a target maximum resolution."""
-        if not self._scaling_enabled:
-            return x, y
+    def _compute_scaling_factors(self) -> tuple[float, float] | None:
+        """Return the (x, y) factors down to the matching target, or None if no scaling applies."""
         ratio = self.width / self.height
         target_dimension = None
         for dimension in MAX_SCALING_TARGETS.values():
@@ -318,10 +577,18 @@ class BaseComputerToolMacOS:
                     target_dimension = dimension
                 break
         if target_dimension is None:
-            return x, y
+            return None
         # should be less than 1
-        x_scaling_factor = target_dimension["width"] / self.width
-        y_scaling_factor = target_dimension["height"] / self.height
+        return (
+            target_dimension["width"] / self.width,
+            target_dimension["height"] / self.height,
+        )
+
+    def scale_coordinates(self, source: ScalingSource, x: int, y: int):
+        """Scale coordinates to a target maximum resolution."""
+        if not self._scaling_enabled or self._scaling_factors is None:
+            return x, y
+        x_scaling_factor, y_scaling_factor = self._scaling_factors
         if source == ScalingSource.API:
             if x > self.width or y > self.height:
                 raise ToolError(f"Coordinates {x}, {y} are out of bounds")
@@ -378,31 +645,20 @@ class ComputerToolMacOS20250124(BaseComputerToolMacOS, BaseAnthropicTool):
                 raise ToolError(f"{scroll_amount=} must be a non-negative int")
 
             # Move to coordinate if provided
+            position = None
             if coordinate is not None:
-                x, y = self.validate_and_get_coordinates(coordinate)
-                await asyncio.to_thread(pyautogui.moveTo, x, y, duration=0.2)
+                position = self.validate_and_get_coordinates(coordinate)
+
+            # Move, press the modifier key if provided, and scroll in one thread hop
+            await asyncio.to_thread(
+                _modified_scroll,
+                position,
+                translate_key(text) if text else None,
+                scroll_direction,
+                scroll_amount,
+            )
 
-            # Press modifier key if provided
-            if text:
-                translated_key = translate_key(text)
-                await asyncio.to_thread(pyautogui.keyDown, translated_key)
-
-            # Perform scroll
-            # PyAutoGUI uses positive for up/right, negative for down/left
-            if scroll_direction == "up":
-                await asyncio.to_thread(pyautogui.scroll, scroll_amount * 10)
-            elif scroll_direction == "down":
-                await asyncio.to_thread(pyautogui.scroll, -scroll_amount * 10)
-            elif scroll_direction == "left":
-                await asyncio.to_thread(pyautogui.hscroll, -scroll_amount * 10)
-            elif scroll_direction == "right":
-                await asyncio.to_thread(pyautogui.hscroll, scroll_amount * 10)
-
-            # Release modifier key
-            if text:
-                await asyncio.to_thread(pyautogui.keyUp, translated_key)
-
-            await asyncio.sleep(self._screenshot_delay)
+            await self._wait_for_screen_to_settle()
             return await self.screenshot()
 
         if action in ("hold_key", "wait"):
@@ -419,17 +675,15 @@ class ComputerToolMacOS20250124(BaseComputerToolMacOS, BaseAnthropicTool):
                 translated_keys = [translate_key(k.strip()) for k in text.split("+")]
 
                 # Press keys down
-                for k in translated_keys:
-                    await asyncio.to_thread(pyautogui.keyDown, k)
+                await asyncio.to_thread(_key_down_all, translated_keys)
 
                 # Hold
                 await asyncio.sleep(duration)
 
                 # Release keys
-                for k in reversed(translated_keys):
-                    await asyncio.to_thread(pyautogui.keyUp, k)
+                await asyncio.to_thread(_key_up_all, reversed(translated_keys))
 
-                await asyncio.sleep(self._screenshot_delay)
+                await self._wait_for_screen_to_settle()
                 return await self.screenshot()
 
             if action == "wait":
@@ -441,23 +695,16 @@ class ComputerToolMacOS20250124(BaseComputerToolMacOS, BaseAnthropicTool):
                 raise ToolError(f"text is not accepted for {action}")
 
             # Move to coordinate if provided
+            position = None
             if coordinate is not None:
-                x, y = self.validate_and_get_coordinates(coordinate)
-                await asyncio.to_thread(pyautogui.moveTo, x, y, duration=0.2)
-
-            # Press modifier key if provided
-            if key:
-                translated_key = translate_key(key)
-                await asyncio.to_thread(pyautogui.keyDown, translated_key)
-
-            # Triple click
-            await asyncio.to_thread(pyautogui.click, clicks=3)
+                position = self.validate_and_get_coordinates(coordinate)
 
-            # Release modifier key
-            if key:
-                await asyncio.to_thread(pyautogui.keyUp, translated_key)
+            # Move, press the modifier key if provided, and triple click in one thread hop
+            await asyncio.to_thread(
+                _modified_click, position, translate_key(key) if key else None, "left", 3
+            )
 
-            await asyncio.sleep(self._screenshot_delay)
+            await self._wait_for_screen_to_settle()
             return await self.screenshot()
 
         if action in ("left_click", "right_click", "double_click", "middle_click"):
@@ -465,30 +712,17 @@ class ComputerToolMacOS20250124(BaseComputerToolMacOS, BaseAnthropicTool):
                 raise ToolError(f"text is not accepted for {action}")
 
             # Move to coordinate if provided
+            position = None
             if coordinate is not None:
-                x, y = self.validate_and_get_coordinates(coordinate)
-                await asyncio.to_thread(pyautogui.moveTo, x, y, duration=0.2)
-
-            # Press modifier key if provided
-            if key:
-                translated_key = translate_key(key)
-                await asyncio.to_thread(pyautogui.keyDown, translated_key)
-
-            # Perform click
-            if action == "left_click":
-                await asyncio.to_thread(pyautogui.click)
-            elif action == "right_click":
-                await asyncio.to_thread(pyautogui.rightClick)
-            elif action == "middle_click":
-                await asyncio.to_thread(pyautogui.middleClick)
-            elif action == "double_click":
-                await asyncio.to_thread(pyautogui.doubleClick)
+                position = self.validate_and_get_coordinates(coordinate)
 
-            # Release modifier key
-            if key:
-                await asyncio.to_thread(pyautogui.keyUp, translated_key)
+            # Move, press the modifier key if provided, and click in one thread hop
+            button, clicks = CLICK_ACTIONS[action]
+            await asyncio.to_thread(
+                _modified_click, position, translate_key(key) if key else None, button, clicks
+            )
 
-            await asyncio.sleep(self._screenshot_delay)
+            await self._wait_for_screen_to_settle()
             return await self.screenshot()
 
         # Fall back to base implementation for other actions
@@ -2,13 +2,60 @@
 Vector database for semantic search over action logs using Annoy and sentence-transformers.
 """
 
+import functools
 import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
+import numpy as np
+import orjson
 from annoy import AnnoyIndex
-from sentence_transformers import SentenceTransformer
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+
+def _parse_log(log_file: Path) -> tuple[dict[str, Any] | None, str | None]:
+    """
+    Parse one action log into an index entry.
+
+    Module-level so it can run in a worker process.
+
+    Returns:
+        (entry, None) on success, or (None, reason) if the log was skipped
+    """
+    try:
+        data = orjson.loads(log_file.read_bytes())
+
+        # Extract request text
+        request_text = data.get("request", {}).get("content", {}).get("text")
+        if not request_text:
+            return None, f"Skipping {log_file.name}: no request text found"
+
+        # Check if narrative exists
+        if "narrative" not in data or not data["narrative"]:
+            return None, f"Skipping {log_file.name}: no narrative found"
+
+        # Parse timestamp
+        recorded_at = data.get("recorded_at", "")
+        try:
+            timestamp = datetime.fromisoformat(recorded_at)
+        except (ValueError, TypeError):
+            timestamp = datetime.min
+
+        return {
+            "request_text": request_text,
+            "narrative": data["narrative"],
+            "timestamp": timestamp,
+            "log_file": log_file.name,
+        }, None
+
+    except (json.JSONDecodeError, KeyError) as e:
+        return None, f"Error reading {log_file.name}: {e}"
 
 
 class ActionVectorDB:
@@ -23,6 +70,14 @@ class ActionVectorDB:
         recordings_dir: str = "recordings",
         model_name: str = "all-MiniLM-L6-v2",
         n_trees: int = 20,
+        device: str | None = None,
+        backend: str = "torch",
+        model_file: str | None = None,
+        n_jobs: int = -1,
+        on_disk: bool = False,
+        model: "SentenceTransformer | None" = None,
+        search_k: int = -1,
+        exact_search_max_items: int = 10_000,
     ):
         """
         Initialize the vector database.
@@ -31,15 +86,46 @@ class ActionVectorDB:
             recordings_dir: Directory containing action log JSON files
             model_name: Sentence transformer model name
             n_trees: Number of trees for Annoy index (more trees = better accuracy, slower)
+            device: Torch device for the model (e.g. "mps", "cpu"); None lets
+                sentence-transformers pick, which prefers MPS on Apple Silicon
+            backend: Inference backend for the model: "torch", "onnx" (ONNX
+                Runtime, needs the onnx extra) or "openvino"
+            model_file: Model file to load for the onnx/openvino backends, e.g.
+                "onnx/model_qint8_arm64.onnx" for an int8-quantized MiniLM
+            n_jobs: Threads used to build Annoy trees (-1 = all cores)
+            on_disk: Build the Annoy index directly in its file instead of in RAM
+            model: Already-loaded model for model_name, e.g. one shared across
+                sessions; loaded here if omitted
+            search_k: Nodes inspected per query (more = better recall, slower);
+                -1 uses Annoy's default of n_trees * k
+            exact_search_max_items: Up to this many entries, queries score every
+                vector with one matrix product (exact, and faster than the trees
+                at this size) instead of searching the Annoy index
         """
         self.recordings_dir = Path(recordings_dir)
         self.model_name = model_name
         self.n_trees = n_trees
-
-        # Initialize sentence transformer model
-        self.model = SentenceTransformer(model_name)
+        self.n_jobs = n_jobs
+        self.on_disk = on_disk
+        self.search_k = search_k
+        self.exact_search_max_items = exact_search_max_items
+
+        # Initialize sentence transformer model (imported here: it pulls in torch)
+        if model is None:
+            from sentence_transformers import SentenceTransformer
+
+            model = SentenceTransformer(
+                model_name,
+                device=device,
+                backend=backend,
+                model_kwargs={"file_name": model_file} if model_file else None,
+            )
+        self.model = model
         self.embedding_dim = self.model.get_sentence_embedding_dimension()
 
+        # Size-capped cache of query embeddings, keyed by query text
+        self._embed_query = functools.lru_cache(maxsize=1024)(self._embed)
+
         # Initialize Annoy index
         self.index = AnnoyIndex(self.embedding_dim, "angular")
 
@@ -47,16 +133,50 @@ class ActionVectorDB:
         self.metadata: dict[int, dict[str, Any]] = {}
         self.next_id = 0
 
+        # Modification times of the log files seen by the last build, by filename
+        self.log_mtimes: dict[str, float] = {}
+
+        # Whether self.index holds the built entries (see ensure_index)
+        self.index_loaded = False
+
+        # Entries added by add_to_index that self.index doesn't hold yet, by id
+        self._pending_vectors: dict[int, Any] = {}
+        self._save_after_rebuild = False
+        # Guards swapping self.index (and its metadata) against queries
+        self._index_lock = threading.Lock()
+        # Serializes add_to_index rebuilds
+        self._rebuild_lock = threading.Lock()
+        self._rebuild_thread: threading.Thread | None = None
+
+        # Unit-length copy of the vectors in self._matrix_index, for exact search
+        self._matrix: np.ndarray | None = None
+        self._matrix_index: AnnoyIndex | None = None
+
         # Index files
         self.index_file = self.recordings_dir / "actions.ann"
         self.metadata_file = self.recordings_dir / "index_metadata.json"
 
-    def build_index_from_logs(self, verbose: bool = True) -> int:
+    def build_index_from_logs(
+        self,
+        verbose: bool = True,
+        jobs: int = 1,
+        batch_size: int = 64,
+        incremental: bool = False,
+    ) -> int:
         """
         Build Annoy index from all action log files in recordings directory.
 
         Deduplicates by request text - keeps only the latest recording for each unique request.
 
+        Args:
+            verbose: Print progress and skipped files
+            jobs: Number of worker processes used to parse log files; with 1, a
+                thread pool overlaps the file reads instead
+            batch_size: Number of request texts embedded per model forward pass
+            incremental: Reuse the saved index and only parse logs added since it
+                was built. Falls back to a full rebuild if an indexed log was
+                modified or removed.
+
         Returns:
             Number of unique requests indexed
         """
@@ -64,57 +184,68 @@ class ActionVectorDB:
             raise ValueError(f"Recordings directory not found: {self.recordings_dir}")
 
         # Collect all valid action logs
-        log_files = sorted(self.recordings_dir.glob("action_log_*.json"))
+        log_entries = self._scan_logs()
 
-        if not log_files:
+        if not log_entries:
             if verbose:
                 print("No action log files found")
             return 0
 
-        # Group logs by request text, keeping track of timestamps
-        request_to_logs: dict[str, list[dict]] = {}
+        log_files = [Path(entry.path) for entry in log_entries]
+        log_mtimes = {entry.name: entry.stat().st_mtime for entry in log_entries}
 
-        for log_file in log_files:
-            try:
-                with open(log_file) as f:
-                    data = json.load(f)
-
-                # Extract request text
-                request_text = data.get("request", {}).get("content", {}).get("text")
-                if not request_text:
-                    if verbose:
-                        print(f"Skipping {log_file.name}: no request text found")
-                    continue
-
-                # Check if narrative exists
-                if "narrative" not in data or not data["narrative"]:
-                    if verbose:
-                        print(f"Skipping {log_file.name}: no narrative found")
-                    continue
-
-                # Parse timestamp
-                recorded_at = data.get("recorded_at", "")
-                try:
-                    timestamp = datetime.fromisoformat(recorded_at)
-                except (ValueError, TypeError):
-                    timestamp = datetime.min
-
-                # Add to grouped logs
-                if request_text not in request_to_logs:
-                    request_to_logs[request_text] = []
-
-                request_to_logs[request_text].append({
-                    "request_text": request_text,
-                    "narrative": data["narrative"],
-                    "timestamp": timestamp,
-                    "log_file": log_file.name,
-                })
+        # Entries from the saved index that can be kept as-is, with their vectors
+        reused_logs: list[dict[str, Any]] = []
+        files_to_parse = log_files
+        if incremental and self.load_index():
+            indexed_unchanged = all(
+                self.log_mtimes.get(meta["log_file"]) == log_mtimes.get(meta["log_file"])
+                for meta in self.metadata.values()
+            )
+            if indexed_unchanged:
+                for idx, meta in self.metadata.items():
+                    reused_logs.append({
+                        "request_text": meta["request_text"],
+                        "narrative": meta["narrative"],
+                        "timestamp": datetime.fromisoformat(meta["timestamp"]),
+                        "log_file": meta["log_file"],
+                        "embedding": self.index.get_item_vector(idx),
+                    })
+                files_to_parse = [
+                    log_file
+                    for log_file in log_files
+                    if self.log_mtimes.get(log_file.name) != log_mtimes[log_file.name]
+                ]
+                if verbose:
+                    print(f"Incremental build: {len(files_to_parse)} new log files to parse")
+            elif verbose:
+                print("Indexed logs changed since last build, rebuilding from scratch")
 
-            except (json.JSONDecodeError, KeyError) as e:
+        self._reset_index()
+
+        # Group logs by request text, keeping track of timestamps
+        request_to_logs: dict[str, list[dict]] = {}
+        for log in reused_logs:
+            request_to_logs.setdefault(log["request_text"], []).append(log)
+
+        if jobs > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                parsed = list(executor.map(_parse_log, files_to_parse, chunksize=16))
+        elif files_to_parse:
+            with ThreadPoolExecutor(max_workers=min(32, len(files_to_parse))) as executor:
+                parsed = list(executor.map(_parse_log, files_to_parse))
+        else:
+            parsed = []
+
+        for entry, reason in parsed:
+            if entry is None:
                 if verbose:
-                    print(f"Error reading {log_file.name}: {e}")
+                    print(reason)
                 continue
 
+            # Add to grouped logs
+            request_to_logs.setdefault(entry["request_text"], []).append(entry)
+
         # Deduplicate: keep only the latest log for each request text
         unique_logs = []
         for request_text, logs in request_to_logs.items():
@@ -125,6 +256,18 @@ class ActionVectorDB:
             if verbose and len(logs) > 1:
                 print(f"Deduplicated '{request_text}': kept latest from {latest_log['log_file']}")
 
+        # Embed all new request texts in one batched call
+        to_embed = [log for log in unique_logs if "embedding" not in log]
+        if to_embed:
+            embeddings = self.model.encode(
+                [log["request_text"] for log in to_embed],
+                batch_size=batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+            )
+            for log, embedding in zip(to_embed, embeddings):
+                log["embedding"] = embedding
+
         # Build index
         for log in unique_logs:
             self._add_to_index_internal(
@@ -132,31 +275,50 @@ class ActionVectorDB:
                 narrative=log["narrative"],
                 timestamp=log["timestamp"].isoformat(),
                 log_file=log["log_file"],
+                embedding=log["embedding"],
             )
+        self.log_mtimes = log_mtimes
 
         # Build the Annoy index
+        self.index_loaded = True
         if self.next_id > 0:
-            self.index.build(self.n_trees)
+            self.index.build(self.n_trees, n_jobs=self.n_jobs)
             if verbose:
                 print(f"\nIndexed {self.next_id} unique requests from {len(log_files)} log files")
 
         return self.next_id
 
+    def _reset_index(self):
+        """Discard all indexed entries and start from an empty Annoy index."""
+        self.index.unload()
+        self.index = AnnoyIndex(self.embedding_dim, "angular")
+        if self.on_disk:
+            self.recordings_dir.mkdir(parents=True, exist_ok=True)
+            self.index.on_disk_build(str(self.index_file))
+        self.metadata = {}
+        self.log_mtimes = {}
+        self.next_id = 0
+
     def _add_to_index_internal(
         self,
         request_text: str,
         narrative: str,
         timestamp: str,
         log_file: str,
+        embedding: Any = None,
     ) -> int:
         """
         Internal method to add an entry to the index (without rebuilding).
 
+        Args:
+            embedding: Precomputed embedding for request_text; computed if omitted
+
         Returns:
             The index ID assigned to this entry
         """
         # Embed the request text
-        embedding = self.model.encode(request_text)
+        if embedding is None:
+            embedding = self.model.encode(request_text, normalize_embeddings=True)
 
         # Add to Annoy index
         idx = self.next_id
@@ -178,40 +340,112 @@ class ActionVectorDB:
         request_text: str,
         narrative: str,
         log_file: str,
+        embedding: Any = None,
+        background: bool = False,
+        save: bool = False,
     ) -> int:
         """
         Add a new entry to the index and rebuild.
 
         Use this after recording a new action log to update the index incrementally.
+        A built Annoy index can't take new items, so a fresh index is built from
+        the current vectors plus the new one and then swapped in; queries keep
+        using the current index until then.
 
         Args:
             request_text: The user's request text
             narrative: The generated narrative for this request
             log_file: The filename of the action log
+            embedding: Precomputed embedding for request_text; computed if omitted
+            background: Rebuild in a background thread and return right away
+                (see wait_for_rebuild)
+            save: Save the index and metadata once the new index is swapped in
 
         Returns:
-            The index ID assigned to this entry
+            The index ID assigned to this entry, or the existing ID if log_file
+            is already indexed
         """
-        timestamp = datetime.now().isoformat()
-
-        # Add to index
-        idx = self._add_to_index_internal(
-            request_text=request_text,
-            narrative=narrative,
-            timestamp=timestamp,
-            log_file=log_file,
-        )
-
-        # Rebuild the index
-        self.index.build(self.n_trees)
+        self.ensure_index()
+        # With no saved index, ensure_index() has just built one from the
+        # recordings directory, which already includes this log
+        with self._index_lock:
+            for idx, entry in self.metadata.items():
+                if entry["log_file"] == log_file:
+                    return idx
+
+        if embedding is None:
+            embedding = self._embed(request_text)
+
+        # Remember the log so incremental builds don't parse it again
+        log_path = self.recordings_dir / log_file
+        log_mtime = log_path.stat().st_mtime if log_path.exists() else None
+
+        with self._index_lock:
+            idx = self.next_id
+            self.metadata[idx] = {
+                "request_text": request_text,
+                "narrative": narrative,
+                "timestamp": datetime.now().isoformat(),
+                "log_file": log_file,
+            }
+            self.next_id += 1
+            if log_mtime is not None:
+                self.log_mtimes[log_file] = log_mtime
+            self._pending_vectors[idx] = embedding
+            self._save_after_rebuild |= save
+
+        if background:
+            self._rebuild_thread = threading.Thread(
+                target=self._rebuild_with_pending, name="vector-db-rebuild"
+            )
+            self._rebuild_thread.start()
+        else:
+            self._rebuild_with_pending()
 
         return idx
 
+    def _rebuild_with_pending(self):
+        """Build a new index from the current one plus pending entries, then swap it in."""
+        with self._rebuild_lock:
+            with self._index_lock:
+                pending = self._pending_vectors
+                self._pending_vectors = {}
+                save = self._save_after_rebuild
+                self._save_after_rebuild = False
+                current = self.index
+
+            # An earlier rebuild already took these entries
+            if pending:
+                index = AnnoyIndex(self.embedding_dim, "angular")
+                for idx in range(current.get_n_items()):
+                    index.add_item(idx, current.get_item_vector(idx))
+                for idx, embedding in pending.items():
+                    index.add_item(idx, embedding)
+                index.build(self.n_trees, n_jobs=self.n_jobs)
+
+                with self._index_lock:
+                    self.index = index
+                    # Frees the old index, including its mmap of the index file
+                    current.unload()
+
+            if save:
+                self.save_index()
+
+    def wait_for_rebuild(self):
+        """Block until a background rebuild started by add_to_index has finished."""
+        if self._rebuild_thread is not None:
+            self._rebuild_thread.join()
+
+    def _embed(self, text: str) -> Any:
+        """Embed a single text with normalized output."""
+        return self.model.encode(text, normalize_embeddings=True)
+
     def query_similar(
         self,
         request_text: str,
         k: int = 1,
         min_similarity: float = 0.5,
+        query_embedding: Any = None,
     ) -> list[dict[str, Any]]:
         """
         Query for similar requests and return their narratives.
@@ -220,36 +454,45 @@ class ActionVectorDB:
             request_text: The query text
             k: Number of similar results to return
             min_similarity: Minimum cosine similarity threshold (0-1)
+            query_embedding: Precomputed embedding of request_text; computed if omitted
 
         Returns:
-            List of dicts with keys: request_text, narrative, similarity, log_file
-            Sorted by similarity (highest first)
+            List of dicts with keys: id, request_text, narrative, similarity, log_file,
+            timestamp. Sorted by similarity (highest first)
         """
+        self.ensure_index()
         if self.next_id == 0:
             return []
 
-        # Embed the query
-        query_embedding = self.model.encode(request_text)
+        # Embed the query (cached for repeated requests)
+        if query_embedding is None:
+            query_embedding = self._embed_query(request_text)
 
         # Search in Annoy
         # Annoy returns (index_ids, distances) where distance is angular distance
-        indices, distances = self.index.get_nns_by_vector(
-            query_embedding,
-            k,
-            include_distances=True,
-        )
-
-        # Convert angular distance to cosine similarity
-        # Angular distance d relates to cosine similarity as: cos_sim = 1 - (d^2 / 2)
-        # For small distances, we can approximate: cos_sim ≈ 1 - d^2/2
-        results = []
-        for idx, distance in zip(indices, distances):
-            # More accurate conversion from angular distance to cosine similarity
-            cosine_similarity = 1.0 - (distance ** 2) / 2.0
+        with self._index_lock:
+            n_items = self.index.get_n_items()
+            if n_items == 0:
+                return []
+            if n_items <= self.exact_search_max_items:
+                indices, similarities = self._exact_search(query_embedding, k)
+            else:
+                indices, distances = self.index.get_nns_by_vector(
+                    query_embedding,
+                    k,
+                    search_k=self.search_k,
+                    include_distances=True,
+                )
+                # Convert angular distance to cosine similarity
+                # Angular distance d relates to cosine similarity as: cos_sim = 1 - (d^2 / 2)
+                similarities = [1.0 - (distance ** 2) / 2.0 for distance in distances]
+            metadata = [self.metadata[idx] for idx in indices]
 
+        results = []
+        for idx, cosine_similarity, meta in zip(indices, similarities, metadata):
             if cosine_similarity >= min_similarity:
-                meta = self.metadata[idx]
                 results.append({
+                    "id": idx,
                     "request_text": meta["request_text"],
                     "narrative": meta["narrative"],
                     "similarity": cosine_similarity,
@@ -259,6 +502,29 @@ class ActionVectorDB:
 
         return results
 
+    def _exact_search(self, query_embedding: Any, k: int) -> tuple[list[int], list[float]]:
+        """
+        Score every indexed vector against the query with one matrix product.
+
+        Returns the ids and cosine similarities of the top k, highest first.
+        Must be called with _index_lock held.
+        """
+        if self._matrix_index is not self.index:
+            matrix = np.array(
+                [self.index.get_item_vector(idx) for idx in range(self.index.get_n_items())],
+                dtype=np.float32,
+            )
+            matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+            self._matrix = matrix
+            self._matrix_index = self.index
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        scores = self._matrix @ (query / np.linalg.norm(query))
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return top.tolist(), scores[top].tolist()
+
     def save_index(self) -> bool:
         """
         Save the Annoy index and metadata to disk.
@@ -270,31 +536,45 @@ class ActionVectorDB:
             # Ensure recordings directory exists
             self.recordings_dir.mkdir(parents=True, exist_ok=True)
 
-            # Save Annoy index
-            self.index.save(str(self.index_file))
+            with self._index_lock:
+                # Save Annoy index
+                self.index.save(str(self.index_file))
+
+                # Leave out entries still waiting for a rebuild, so the saved
+                # metadata matches the saved index
+                n_items = self.index.get_n_items()
+                pending_logs = {
+                    self.metadata[idx]["log_file"] for idx in self._pending_vectors
+                }
+                data = {
+                    "model_name": self.model_name,
+                    "embedding_dim": self.embedding_dim,
+                    "n_trees": self.n_trees,
+                    "next_id": n_items,
+                    "metadata": {
+                        idx: meta for idx, meta in self.metadata.items() if idx < n_items
+                    },
+                    "log_mtimes": {
+                        name: mtime
+                        for name, mtime in self.log_mtimes.items()
+                        if name not in pending_logs
+                    },
+                }
 
             # Save metadata
             with open(self.metadata_file, "w") as f:
-                json.dump(
-                    {
-                        "model_name": self.model_name,
-                        "embedding_dim": self.embedding_dim,
-                        "n_trees": self.n_trees,
-                        "next_id": self.next_id,
-                        "metadata": self.metadata,
-                    },
-                    f,
-                    indent=2,
-                )
+                json.dump(data, f, indent=2)
 
             return True
         except Exception as e:
             print(f"Error saving index: {e}")
             return False
 
-    def load_index(self) -> bool:
+    def load_metadata(self) -> bool:
         """
-        Load a previously saved Annoy index and metadata from disk.
+        Load only the saved metadata (request texts, narratives, counts) from disk.
+
+        This is cheap: the Annoy index is left unloaded until ensure_index() runs.
 
         Returns:
             True if successful, False otherwise
@@ -304,7 +584,6 @@ class ActionVectorDB:
             if not self.index_file.exists() or not self.metadata_file.exists():
                 return False
 
-            # Load metadata first
             with open(self.metadata_file) as f:
                 data = json.load(f)
 
@@ -324,12 +603,62 @@ class ActionVectorDB:
             # Restore metadata
             self.next_id = data["next_id"]
             self.metadata = {int(k): v for k, v in data["metadata"].items()}
+            self.log_mtimes = data.get("log_mtimes", {})
+
+            return True
+        except Exception as e:
+            print(f"Error loading index: {e}")
+            return False
+
+    def load_index(self) -> bool:
+        """
+        Load a previously saved Annoy index and metadata from disk.
+
+        Returns:
+            True if successful, False otherwise
+        """
+        if not self.load_metadata():
+            return False
 
+        try:
             # Load Annoy index
             self.index = AnnoyIndex(self.embedding_dim, "angular")
             self.index.load(str(self.index_file))
+            self.index_loaded = True
 
             return True
         except Exception as e:
             print(f"Error loading index: {e}")
             return False
+
+    def ensure_index(self, verbose: bool = False) -> int:
+        """
+        Make the Annoy index queryable: load it from disk, or build it from logs
+        (and save it) if no saved index exists. Does nothing once loaded.
+
+        Returns:
+            Number of indexed requests
+        """
+        if not self.index_loaded and not self.load_index():
+            if self.has_logs() and self.build_index_from_logs(verbose=verbose) > 0:
+                self.save_index()
+            self.index_loaded = True
+        return self.next_id
+
+    def _scan_logs(self) -> list[os.DirEntry]:
+        """List the action log files in the recordings directory, sorted by name."""
+        with os.scandir(self.recordings_dir) as entries:
+            return sorted(
+                (
+                    entry
+                    for entry in entries
+                    if entry.name.startswith("action_log_")
+                    and entry.name.endswith(".json")
+                    and entry.is_file()
+                ),
+                key=lambda entry: entry.name,
+            )
+
+    def has_logs(self) -> bool:
+        """Return whether the recordings directory contains any action logs."""
+        return self.recordings_dir.exists() and bool(self._scan_logs())
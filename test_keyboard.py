@@ -5,15 +5,25 @@ Tests various key combinations including cmd+space (Spotlight).
 """
 
 import asyncio
+import atexit
+import functools
+import os
 import pyautogui
 import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import Quartz
+except ImportError:
+    Quartz = None
 
 # Disable failsafe
 pyautogui.FAILSAFE = False
 pyautogui.PAUSE = 0.01
 
 # Key mapping from computer_macos.py
-MACOS_KEY_MAPPING = {
+MACOS_KEY_MAPPING = types.MappingProxyType({
     "cmd": "command",
     "ctrl": "command",
     "Control_L": "command",
@@ -29,20 +39,85 @@ MACOS_KEY_MAPPING = {
     "Return": "enter",
     "BackSpace": "backspace",
     "space": "space",
-}
-
+})
+
+# macOS virtual keycodes (from HIToolbox Events.h) for keys used by the tests
+KEYCODES = types.MappingProxyType({
+    "a": 0,
+    "return": 36,
+    "enter": 36,
+    "tab": 48,
+    "space": 49,
+    "escape": 53,
+    "command": 55,
+    "shift": 56,
+    "option": 58,
+})
+
+# Modifier keys and the CGEventFlags bit each one sets, as attribute names so
+# the table can be built without Quartz installed
+MODIFIER_FLAGS = types.MappingProxyType({
+    "command": "kCGEventFlagMaskCommand",
+    "shift": "kCGEventFlagMaskShift",
+    "option": "kCGEventFlagMaskAlternate",
+    "ctrl": "kCGEventFlagMaskControl",
+})
+
+_COMBO_CACHE: dict[str, tuple[str, ...]] = {}
+
+# All input posting (pyautogui and raw CGEvents) runs on one dedicated worker
+# so keystrokes can never be reordered, and don't queue behind other work in
+# the default executor.
+_UI_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pyautogui")
+atexit.register(_UI_POOL.shutdown)
+
+
+async def _ui(fn, *args, **kwargs):
+    """Run a blocking input call on the UI worker thread."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_UI_POOL, functools.partial(fn, *args, **kwargs))
+
+
+@functools.lru_cache(maxsize=256)
 def translate_key(key: str) -> str:
     """Translate X11/Linux key names to macOS/PyAutoGUI key names."""
     return MACOS_KEY_MAPPING.get(key, key.lower())
 
 
+def parse_combo(text: str) -> tuple[str, ...]:
+    """Split a combo like 'cmd+space' into translated keys, caching the result."""
+    keys = _COMBO_CACHE.get(text)
+    if keys is None:
+        keys = _COMBO_CACHE[text] = tuple(translate_key(k.strip()) for k in text.split("+"))
+    return keys
+
+
+def post_flagged_combo(keys: tuple[str, ...]) -> bool:
+    """
+    Post a modifier combo (e.g. command+space) as one key-down/key-up pair
+    carrying the modifier flags, instead of one event per key.
+    Returns False if the combo can't be expressed that way.
+    """
+    *modifiers, key = keys
+    if Quartz is None or key not in KEYCODES or not all(m in MODIFIER_FLAGS for m in modifiers):
+        return False
+    flags = 0
+    for modifier in modifiers:
+        flags |= getattr(Quartz, MODIFIER_FLAGS[modifier])
+    for key_down in (True, False):
+        event = Quartz.CGEventCreateKeyboardEvent(None, KEYCODES[key], key_down)
+        Quartz.CGEventSetFlags(event, flags)
+        Quartz.CGEventPost(Quartz.kCGHIDEventTap, event)
+    return True
+
+
 async def test_single_key(key: str):
     """Test pressing a single key."""
     print(f"\n[TEST] Single key: '{key}'")
     translated = translate_key(key)
     print(f"  Translated: '{translated}'")
     try:
-        await asyncio.to_thread(pyautogui.press, translated)
+        await _ui(pyautogui.press, translated)
         print(f"  ✓ Successfully pressed: {translated}")
         return True
     except Exception as e:
@@ -53,7 +128,7 @@ async def test_single_key(key: str):
 async def test_key_combination(text: str):
     """Test pressing a key combination (e.g., cmd+space)."""
     print(f"\n[TEST] Key combination: '{text}'")
-    keys = [translate_key(k.strip()) for k in text.split("+")]
+    keys = parse_combo(text)
     print(f"  Translated: {' + '.join(keys)}")
 
     # Wait a moment for user to see what's about to happen
@@ -61,7 +136,8 @@ async def test_key_combination(text: str):
     await asyncio.sleep(2)
 
     try:
-        await asyncio.to_thread(pyautogui.hotkey, *keys)
+        if not await _ui(post_flagged_combo, keys):
+            await _ui(pyautogui.hotkey, *keys)
         print(f"  ✓ Successfully pressed: {' + '.join(keys)}")
         return True
     except Exception as e:
@@ -69,15 +145,38 @@ async def test_key_combination(text: str):
         return False
 
 
+async def test_spotlight(
+    title: str,
+    intro: list[str],
+    combo: str,
+    spotlight_ready: asyncio.Event,
+    spotlight_gone: asyncio.Event,
+) -> bool:
+    """Open Spotlight with combo and close it again."""
+    print("\n" + "-" * 60)
+    print(title)
+    print("-" * 60)
+    for line in intro:
+        print(line)
+    await asyncio.sleep(2)
+    passed = await test_key_combination(combo)
+    await wait_for_event(spotlight_ready, timeout=2.0)
+
+    print("\nClosing Spotlight with Escape...")
+    await _ui(pyautogui.press, "escape")
+    await wait_for_event(spotlight_gone, timeout=1.0)
+    return passed
+
+
 async def test_key_down_up(key: str, duration: float = 0.5):
     """Test holding a key for a duration."""
     print(f"\n[TEST] Hold key: '{key}' for {duration}s")
     translated = translate_key(key)
     print(f"  Translated: '{translated}'")
     try:
-        await asyncio.to_thread(pyautogui.keyDown, translated)
+        await _ui(pyautogui.keyDown, translated)
         await asyncio.sleep(duration)
-        await asyncio.to_thread(pyautogui.keyUp, translated)
+        await _ui(pyautogui.keyUp, translated)
         print(f"  ✓ Successfully held and released: {translated}")
         return True
     except Exception as e:
@@ -90,7 +189,7 @@ async def test_typing(text: str, interval: float = 0.012):
     print(f"\n[TEST] Typing: '{text}'")
     print(f"  Interval: {interval}s per character")
     try:
-        await asyncio.to_thread(pyautogui.write, text, interval=interval)
+        await _ui(pyautogui.write, text, interval=interval)
         print(f"  ✓ Successfully typed: {text}")
         return True
     except Exception as e:
@@ -98,6 +197,47 @@ async def test_typing(text: str, interval: float = 0.012):
         return False
 
 
+# Spotlight's search panel is far taller than its menu-bar status item
+SPOTLIGHT_PANEL_MIN_HEIGHT = 40
+
+
+def spotlight_visible() -> bool:
+    """Return whether the Spotlight search panel is currently on screen."""
+    windows = Quartz.CGWindowListCopyWindowInfo(
+        Quartz.kCGWindowListOptionOnScreenOnly, Quartz.kCGNullWindowID
+    )
+    # The always-present menu-bar icon is also owned by Spotlight, so skip
+    # the status-bar layer and anything too short to be the panel.
+    status_layer = Quartz.CGWindowLevelForKey(Quartz.kCGStatusWindowLevelKey)
+    return any(
+        w.get("kCGWindowOwnerName") == "Spotlight"
+        and w.get("kCGWindowLayer") != status_layer
+        and w.get("kCGWindowBounds", {}).get("Height", 0) >= SPOTLIGHT_PANEL_MIN_HEIGHT
+        for w in windows or ()
+    )
+
+
+async def watch_spotlight(ready: asyncio.Event, gone: asyncio.Event, interval: float = 0.01):
+    """Keep the ready/gone events in sync with Spotlight's on-screen state."""
+    while True:
+        if await asyncio.to_thread(spotlight_visible):
+            gone.clear()
+            ready.set()
+        else:
+            ready.clear()
+            gone.set()
+        await asyncio.sleep(interval)
+
+
+async def wait_for_event(event: asyncio.Event, timeout: float) -> bool:
+    """Wait for an event, giving up after timeout seconds."""
+    try:
+        await asyncio.wait_for(event.wait(), timeout=timeout)
+        return True
+    except TimeoutError:
+        return False
+
+
 async def diagnostic_info():
     """Print diagnostic information about PyAutoGUI and the system."""
     print("=" * 60)
@@ -109,15 +249,33 @@ async def diagnostic_info():
     print(f"FAILSAFE: {pyautogui.FAILSAFE}")
     print(f"PAUSE: {pyautogui.PAUSE}")
 
-    # Test if we can detect modifier keys
-    print("\nTesting key press detection:")
     test_keys = ["command", "option", "shift", "space", "a"]
-    for key in test_keys:
-        try:
-            pyautogui.press(key)
-            print(f"  ✓ '{key}' - OK")
-        except Exception as e:
-            print(f"  ✗ '{key}' - FAILED: {str(e)}")
+    if Quartz is None:
+        # Test if we can detect modifier keys
+        print("\nTesting key press detection:")
+        for key in test_keys:
+            try:
+                pyautogui.press(key)
+                print(f"  ✓ '{key}' - OK")
+            except Exception as e:
+                print(f"  ✗ '{key}' - FAILED: {str(e)}")
+    else:
+        # Probe event creation without posting to the global event tap, so the
+        # diagnostic never types into whatever app has focus.
+        print("\nTesting key event creation:")
+        source = Quartz.CGEventSourceCreate(Quartz.kCGEventSourceStateHIDSystemState)
+        print("  ✓ CGEventSource available" if source else "  ✗ CGEventSource unavailable")
+        pid = os.getpid()
+        for key in test_keys:
+            try:
+                for key_down in (True, False):
+                    event = Quartz.CGEventCreateKeyboardEvent(source, KEYCODES[key], key_down)
+                    if event is None:
+                        raise RuntimeError("CGEventCreateKeyboardEvent returned NULL")
+                    Quartz.CGEventPostToPid(pid, event)
+                print(f"  ✓ '{key}' - OK")
+            except Exception as e:
+                print(f"  ✗ '{key}' - FAILED: {str(e)}")
 
     print("=" * 60)
 
@@ -136,49 +294,42 @@ async def main():
 
     results = []
 
-    # Test 1: cmd+space (Spotlight) - THE CRITICAL TEST
-    print("\n" + "-" * 60)
-    print("TEST 1: cmd+space (Spotlight) - CRITICAL TEST")
-    print("-" * 60)
-    print("\nThis will attempt to open Spotlight.")
-    print("Watch for the Spotlight search bar to appear!")
-    print("Testing in 2 seconds...")
-    await asyncio.sleep(2)
-    results.append(await test_key_combination("cmd+space"))
-    await asyncio.sleep(2)
-
-    # Close Spotlight with Escape
-    print("\nClosing Spotlight with Escape...")
-    await asyncio.to_thread(pyautogui.press, "escape")
-    await asyncio.sleep(1)
-
-    # Test 2: cmd+space again (to verify it's consistent)
-    print("\n" + "-" * 60)
-    print("TEST 2: cmd+space (Second attempt)")
-    print("-" * 60)
-    print("Testing again to verify consistency...")
-    await asyncio.sleep(2)
-    results.append(await test_key_combination("cmd+space"))
-    await asyncio.sleep(2)
-
-    # Close Spotlight again
-    print("\nClosing Spotlight with Escape...")
-    await asyncio.to_thread(pyautogui.press, "escape")
-    await asyncio.sleep(1)
-
-    # Test 3: Alternative method - using "command" directly
-    print("\n" + "-" * 60)
-    print("TEST 3: command+space (using 'command' directly)")
-    print("-" * 60)
-    print("Testing with explicit 'command' key...")
-    await asyncio.sleep(2)
-    results.append(await test_key_combination("command+space"))
-    await asyncio.sleep(2)
-
-    # Close Spotlight
-    print("\nClosing Spotlight with Escape...")
-    await asyncio.to_thread(pyautogui.press, "escape")
-    await asyncio.sleep(1)
+    # Without Quartz the events are never set and each wait falls back to
+    # its timeout, matching the old fixed delays.
+    spotlight_ready = asyncio.Event()
+    spotlight_gone = asyncio.Event()
+    watcher = None
+    if Quartz is not None:
+        watcher = asyncio.create_task(watch_spotlight(spotlight_ready, spotlight_gone))
+
+    # Tests 1-3: cmd+space (Spotlight) - THE CRITICAL TESTS
+    trials = [
+        (
+            "TEST 1: cmd+space (Spotlight) - CRITICAL TEST",
+            [
+                "\nThis will attempt to open Spotlight.",
+                "Watch for the Spotlight search bar to appear!",
+                "Testing in 2 seconds...",
+            ],
+            "cmd+space",
+        ),
+        (
+            "TEST 2: cmd+space (Second attempt)",
+            ["Testing again to verify consistency..."],
+            "cmd+space",
+        ),
+        (
+            "TEST 3: command+space (using 'command' directly)",
+            ["Testing with explicit 'command' key..."],
+            "command+space",
+        ),
+    ]
+
+    # Spotlight state is global, so the trials have to run one after another
+    for title, intro, combo in trials:
+        results.append(
+            await test_spotlight(title, intro, combo, spotlight_ready, spotlight_gone)
+        )
 
     # Test 4: Other common combinations
     print("\n" + "-" * 60)
@@ -190,6 +341,9 @@ async def main():
     results.append(await test_key_combination("cmd+tab"))
     await asyncio.sleep(2)
 
+    if watcher is not None:
+        watcher.cancel()
+
     # Summary
     print("\n" + "=" * 60)
     print("TEST SUMMARY")
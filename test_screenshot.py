@@ -5,162 +5,189 @@ This script captures screenshots and displays detailed information about the cap
 """
 
 import asyncio
+import base64
 import os
+import traceback
+from io import BytesIO
 from pathlib import Path
 from datetime import datetime
 
 import pyautogui
 from PIL import Image
 
-# Import the computer tool
-import sys
-sys.path.insert(0, str(Path(__file__).parent))
-from computer_use_demo.tools.computer_macos import ComputerToolMacOS20241022, ComputerToolMacOS20250124
+# Import the computer tool (the script's own directory is already on sys.path)
+from computer_use_demo.tools.computer_macos import (
+    ComputerToolMacOS20241022,
+    ComputerToolMacOS20250124,
+    _capture_screen,
+)
 
+# Every file from one run shares a timestamp, so the set is easy to compare.
+OUTPUT_DIR = Path("/tmp/screenshot_tests")
+OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+RUN_TIMESTAMP = datetime.now().strftime("%Y%m%d_%H%M%S")
 
-async def test_screenshot_basic():
-    """Test basic PyAutoGUI screenshot functionality."""
-    print("\n" + "="*60)
-    print("Testing PyAutoGUI Screenshot (No Scaling)")
-    print("="*60)
+# The tests run concurrently, but only one may grab the screen at a time;
+# saving to disk is left free to overlap with other captures.
+capture_semaphore = asyncio.Semaphore(1)
+
+_screen_size = None
+
+
+def get_screen_size(refresh=False):
+    """Return pyautogui.size(), queried once per run unless refresh is set."""
+    global _screen_size
+    if _screen_size is None or refresh:
+        _screen_size = pyautogui.size()
+    return _screen_size
+
+
+async def test_screenshot_basic(log=print):
+    """Test the raw in-memory capture the tool uses (Quartz, else PyAutoGUI)."""
+    log("\n" + "="*60)
+    log("Testing Raw Screenshot (No Scaling)")
+    log("="*60)
 
     # Get actual screen size
-    screen_size = pyautogui.size()
-    print(f"Screen size detected: {screen_size.width}x{screen_size.height}")
+    screen_size = get_screen_size()
+    log(f"Screen size detected: {screen_size.width}x{screen_size.height}")
 
     # Take screenshot
-    screenshot = pyautogui.screenshot()
-    print(f"Screenshot size: {screenshot.size[0]}x{screenshot.size[1]}")
+    async with capture_semaphore:
+        screenshot = await asyncio.to_thread(_capture_screen)
+    log(f"Screenshot size: {screenshot.size[0]}x{screenshot.size[1]}")
 
     # Save to test outputs
-    output_dir = Path("/tmp/screenshot_tests")
-    output_dir.mkdir(parents=True, exist_ok=True)
-
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    path = output_dir / f"pyautogui_raw_{timestamp}.png"
-    screenshot.save(path)
-    print(f"Saved to: {path}")
+    path = OUTPUT_DIR / f"raw_{RUN_TIMESTAMP}.png"
+    # Fastest zlib level: this is a debug capture, not an archive
+    await asyncio.to_thread(screenshot.save, path, "PNG", compress_level=1)
+    log(f"Saved to: {path}")
 
     # Check if sizes match
     if screenshot.size[0] == screen_size.width and screenshot.size[1] == screen_size.height:
-        print("✓ Screenshot matches screen size")
+        log("✓ Screenshot matches screen size")
     else:
-        print(f"✗ SIZE MISMATCH! Expected {screen_size.width}x{screen_size.height}, got {screenshot.size[0]}x{screenshot.size[1]}")
+        log(f"✗ SIZE MISMATCH! Expected {screen_size.width}x{screen_size.height}, got {screenshot.size[0]}x{screenshot.size[1]}")
 
     return screenshot
 
 
-async def test_computer_tool_screenshot(tool_class, tool_name):
+async def test_computer_tool_screenshot(tool, tool_name, log=print):
     """Test screenshot using the ComputerTool implementation."""
-    print("\n" + "="*60)
-    print(f"Testing {tool_name}")
-    print("="*60)
-
-    # Create tool instance
-    tool = tool_class()
+    log("\n" + "="*60)
+    log(f"Testing {tool_name}")
+    log("="*60)
 
-    print(f"Tool dimensions: {tool.width}x{tool.height}")
-    print(f"Scaling enabled: {tool._scaling_enabled}")
-    print(f"Tool options: {tool.options}")
+    log(f"Tool dimensions: {tool.width}x{tool.height}")
+    log(f"Scaling enabled: {tool._scaling_enabled}")
+    log(f"Tool options: {tool.options}")
 
     # Take screenshot
-    result = await tool.screenshot()
-
-    # Save the base64 image
-    import base64
-    from io import BytesIO
+    async with capture_semaphore:
+        result = await tool.screenshot()
 
+    # Save the base64 image. Image.open only parses the header, which is all
+    # the size checks below need; the encoded bytes are written as-is.
     img_data = base64.b64decode(result.base64_image)
     img = Image.open(BytesIO(img_data))
 
-    print(f"Screenshot size: {img.size[0]}x{img.size[1]}")
-
-    output_dir = Path("/tmp/screenshot_tests")
-    output_dir.mkdir(parents=True, exist_ok=True)
+    log(f"Screenshot size: {img.size[0]}x{img.size[1]}")
 
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    path = output_dir / f"{tool_name.lower().replace(' ', '_')}_{timestamp}.png"
-    img.save(path)
-    print(f"Saved to: {path}")
+    path = OUTPUT_DIR / f"{tool_name.lower().replace(' ', '_')}_{RUN_TIMESTAMP}.jpg"
+    await asyncio.to_thread(path.write_bytes, img_data)
+    log(f"Saved to: {path}")
 
     # Check scaling
-    screen_size = pyautogui.size()
+    screen_size = get_screen_size()
     if img.size[0] != screen_size.width or img.size[1] != screen_size.height:
-        print(f"ℹ Screenshot was scaled from {screen_size.width}x{screen_size.height} to {img.size[0]}x{img.size[1]}")
+        log(f"ℹ Screenshot was scaled from {screen_size.width}x{screen_size.height} to {img.size[0]}x{img.size[1]}")
         scaling_factor = img.size[0] / screen_size.width
-        print(f"  Scaling factor: {scaling_factor:.2f}x")
+        log(f"  Scaling factor: {scaling_factor:.2f}x")
     else:
-        print("✓ Screenshot matches screen size (no scaling)")
+        log("✓ Screenshot matches screen size (no scaling)")
 
     return img
 
 
-async def test_with_scaling_disabled(tool_class, tool_name):
+async def test_with_scaling_disabled(tool, tool_name, log=print):
     """Test screenshot with scaling disabled."""
-    print("\n" + "="*60)
-    print(f"Testing {tool_name} (Scaling Disabled)")
-    print("="*60)
-
-    # Create tool instance and disable scaling
-    tool = tool_class()
-    tool._scaling_enabled = False
-
-    print(f"Tool dimensions: {tool.width}x{tool.height}")
-    print(f"Scaling enabled: {tool._scaling_enabled}")
-    print(f"Tool options: {tool.options}")
-
-    # Take screenshot
-    result = await tool.screenshot()
-
-    # Save the base64 image
-    import base64
-    from io import BytesIO
-
+    log("\n" + "="*60)
+    log(f"Testing {tool_name} (Scaling Disabled)")
+    log("="*60)
+
+    # The tool is shared with the scaled test, so only turn scaling off while
+    # holding the capture semaphore and put it back afterwards.
+    async with capture_semaphore:
+        scaling_enabled = tool._scaling_enabled
+        tool._scaling_enabled = False
+        try:
+            log(f"Tool dimensions: {tool.width}x{tool.height}")
+            log(f"Scaling enabled: {tool._scaling_enabled}")
+            log(f"Tool options: {tool.options}")
+
+            # Take screenshot
+            result = await tool.screenshot()
+        finally:
+            tool._scaling_enabled = scaling_enabled
+
+    # Save the base64 image. Image.open only parses the header, which is all
+    # the size checks below need; the encoded bytes are written as-is.
     img_data = base64.b64decode(result.base64_image)
     img = Image.open(BytesIO(img_data))
 
-    print(f"Screenshot size: {img.size[0]}x{img.size[1]}")
-
-    output_dir = Path("/tmp/screenshot_tests")
-    output_dir.mkdir(parents=True, exist_ok=True)
+    log(f"Screenshot size: {img.size[0]}x{img.size[1]}")
 
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    path = output_dir / f"{tool_name.lower().replace(' ', '_')}_no_scaling_{timestamp}.png"
-    img.save(path)
-    print(f"Saved to: {path}")
+    path = OUTPUT_DIR / f"{tool_name.lower().replace(' ', '_')}_no_scaling_{RUN_TIMESTAMP}.jpg"
+    await asyncio.to_thread(path.write_bytes, img_data)
+    log(f"Saved to: {path}")
 
     # Check if full screen captured
-    screen_size = pyautogui.size()
+    screen_size = get_screen_size()
     if img.size[0] == screen_size.width and img.size[1] == screen_size.height:
-        print("✓ Screenshot matches screen size - full screen captured")
+        log("✓ Screenshot matches screen size - full screen captured")
     else:
-        print(f"✗ SIZE MISMATCH! Expected {screen_size.width}x{screen_size.height}, got {img.size[0]}x{img.size[1]}")
+        log(f"✗ SIZE MISMATCH! Expected {screen_size.width}x{screen_size.height}, got {img.size[0]}x{img.size[1]}")
 
     return img
 
 
-async def test_environment_variables():
+async def test_environment_variables(log=print):
     """Test screenshot with custom environment variables."""
-    print("\n" + "="*60)
-    print("Testing with Custom Environment Variables")
-    print("="*60)
+    log("\n" + "="*60)
+    log("Testing with Custom Environment Variables")
+    log("="*60)
 
-    screen_size = pyautogui.size()
+    screen_size = get_screen_size()
 
     # Set custom dimensions
     os.environ["WIDTH"] = str(screen_size.width)
     os.environ["HEIGHT"] = str(screen_size.height)
 
-    print(f"Set WIDTH={os.environ['WIDTH']}, HEIGHT={os.environ['HEIGHT']}")
+    log(f"Set WIDTH={os.environ['WIDTH']}, HEIGHT={os.environ['HEIGHT']}")
 
     tool = ComputerToolMacOS20241022()
-    print(f"Tool dimensions: {tool.width}x{tool.height}")
+    log(f"Tool dimensions: {tool.width}x{tool.height}")
 
     # Clean up
     del os.environ["WIDTH"]
     del os.environ["HEIGHT"]
 
 
+async def run_buffered(number, test, *args):
+    """
+    Run one test with its output buffered, then print it as a single block so
+    concurrently running tests don't interleave their lines.
+    """
+    lines = []
+    try:
+        return await test(*args, log=lines.append)
+    except Exception as e:
+        lines.append(f"\n✗ Test {number} failed: {e}")
+        lines.append(traceback.format_exc().rstrip())
+    finally:
+        print("\n".join(lines))
+
+
 async def main():
     """Run all screenshot tests."""
     print("\n" + "#"*60)
@@ -168,23 +195,24 @@ async def main():
     print("#"*60)
 
     try:
-        # Test 1: Basic PyAutoGUI screenshot
-        await test_screenshot_basic()
-
-        # Test 2: Environment variables
-        await test_environment_variables()
-
-        # Test 3: ComputerTool with default settings
-        await test_computer_tool_screenshot(ComputerToolMacOS20241022, "ComputerTool 20241022")
-
-        # Test 4: ComputerTool with scaling disabled
-        await test_with_scaling_disabled(ComputerToolMacOS20241022, "ComputerTool 20241022")
-
-        # Test 5: Newer version
-        await test_computer_tool_screenshot(ComputerToolMacOS20250124, "ComputerTool 20250124")
-
-        # Test 6: Newer version with scaling disabled
-        await test_with_scaling_disabled(ComputerToolMacOS20250124, "ComputerTool 20250124")
+        # One instance per tool version, shared by its scaled and unscaled tests
+        tool_20241022 = ComputerToolMacOS20241022()
+        tool_20250124 = ComputerToolMacOS20250124()
+
+        await asyncio.gather(
+            # Test 1: Basic raw screenshot
+            run_buffered(1, test_screenshot_basic),
+            # Test 2: Environment variables
+            run_buffered(2, test_environment_variables),
+            # Test 3: ComputerTool with default settings
+            run_buffered(3, test_computer_tool_screenshot, tool_20241022, "ComputerTool 20241022"),
+            # Test 4: ComputerTool with scaling disabled
+            run_buffered(4, test_with_scaling_disabled, tool_20241022, "ComputerTool 20241022"),
+            # Test 5: Newer version
+            run_buffered(5, test_computer_tool_screenshot, tool_20250124, "ComputerTool 20250124"),
+            # Test 6: Newer version with scaling disabled
+            run_buffered(6, test_with_scaling_disabled, tool_20250124, "ComputerTool 20250124"),
+        )
 
         print("\n" + "="*60)
         print("Summary")
@@ -197,7 +225,6 @@ async def main():
 
     except Exception as e:
         print(f"\n✗ Error during testing: {e}")
-        import traceback
         traceback.print_exc()
 
 
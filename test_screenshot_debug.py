@@ -4,15 +4,71 @@ Debug script to test screenshot permissions and capture on macOS.
 """
 
 import asyncio
+import hashlib
 import sys
 from pathlib import Path
 from datetime import datetime
 
+import numpy as np
 import pyautogui
-from PIL import Image
+from PIL import Image, ImageGrab
+
+from computer_use_demo.tools.computer_macos import _capture_screen, _load_quartz
+
+# Every file from one run shares a timestamp, so the set is easy to compare.
+OUTPUT_DIR = Path("/tmp/screenshot_tests")
+OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+RUN_TIMESTAMP = datetime.now().strftime("%Y%m%d_%H%M%S")
+# Captures are only skimmed for visible content, so they are written as
+# uncompressed BMP rather than spending seconds in zlib per 4K frame.
+SAVE_FORMAT = "BMP"
+
+
+def count_unique_colors(image, sample=1000):
+    """Count distinct colors among the first sample pixels of an image."""
+    width = image.size[0]
+    # Only convert the rows that hold the sample instead of the whole frame.
+    rows = min(image.size[1], -(-sample // width))
+    arr = np.asarray(image.crop((0, 0, width, rows)))
+    pixels = arr.reshape(-1, arr.shape[-1] if arr.ndim == 3 else 1)[:sample]
+    # Pack each pixel (up to 4 bands) into one uint32 so np.unique does a
+    # plain integer sort instead of its much slower row-wise (axis=0) path.
+    padded = np.zeros((len(pixels), 4), dtype=np.uint8)
+    padded[:, :pixels.shape[1]] = pixels
+    return len(np.unique(padded.view(np.uint32)))
+
+
+def report_diversity(image):
+    """Print color diversity stats and warn if the capture looks blank."""
+    unique_colors = count_unique_colors(image)
+    print(f"Unique colors in first 1000 pixels: {unique_colors}")
+
+    # getextrema() scans the whole frame in C, so unlike the sample it also
+    # catches content that starts past the first 1000 pixels.
+    extrema = image.getextrema()
+    if not isinstance(extrema[0], tuple):  # single-band images
+        extrema = (extrema,)
+    digest = hashlib.blake2b(image.tobytes(), digest_size=8).hexdigest()
+    print(f"Frame hash: {digest}")
+
+    if all(lo == hi for lo, hi in extrema):
+        print("⚠️  WARNING: Screenshot is a single solid color - almost certainly a permission issue!")
+    elif unique_colors < 10:
+        print("⚠️  WARNING: Very low color diversity - might be permission issue!")
+
+
+# Saves run on worker threads so each one overlaps the next test's capture
+pending_saves = []
+
+
+def save_in_background(screenshot, path):
+    """Start writing a capture to disk without waiting for it."""
+    pending_saves.append(asyncio.create_task(asyncio.to_thread(screenshot.save, path, SAVE_FORMAT)))
+    print(f"Saving to: {path}")
+
 
 # Test different screenshot methods
-def test_pyautogui_screenshot():
+async def test_pyautogui_screenshot():
     """Test PyAutoGUI screenshot."""
     print("\n" + "="*60)
     print("Test 1: PyAutoGUI Screenshot")
@@ -21,53 +77,35 @@ def test_pyautogui_screenshot():
     screen_size = pyautogui.size()
     print(f"Reported screen size: {screen_size.width}x{screen_size.height}")
 
-    screenshot = pyautogui.screenshot()
+    screenshot = await asyncio.to_thread(pyautogui.screenshot)
     print(f"Actual screenshot size: {screenshot.size[0]}x{screenshot.size[1]}")
 
     # Check pixel diversity (if all pixels are the same, probably permission issue)
-    pixels = list(screenshot.getdata())
-    unique_colors = len(set(pixels[:1000]))  # Sample first 1000 pixels
-    print(f"Unique colors in first 1000 pixels: {unique_colors}")
-
-    if unique_colors < 10:
-        print("⚠️  WARNING: Very low color diversity - might be permission issue!")
+    report_diversity(screenshot)
 
     # Save
-    output_dir = Path("/tmp/screenshot_tests")
-    output_dir.mkdir(parents=True, exist_ok=True)
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    path = output_dir / f"debug_pyautogui_{timestamp}.png"
-    screenshot.save(path)
-    print(f"Saved to: {path}")
+    path = OUTPUT_DIR / f"debug_pyautogui_{RUN_TIMESTAMP}.bmp"
+    save_in_background(screenshot, path)
 
     return screenshot
 
 
-def test_pil_screenshot():
+async def test_pil_screenshot():
     """Test PIL ImageGrab (alternative method)."""
     print("\n" + "="*60)
     print("Test 2: PIL ImageGrab Screenshot")
     print("="*60)
 
     try:
-        from PIL import ImageGrab
-        screenshot = ImageGrab.grab()
+        screenshot = await asyncio.to_thread(ImageGrab.grab)
         print(f"Screenshot size: {screenshot.size[0]}x{screenshot.size[1]}")
 
         # Check pixel diversity
-        pixels = list(screenshot.getdata())
-        unique_colors = len(set(pixels[:1000]))
-        print(f"Unique colors in first 1000 pixels: {unique_colors}")
-
-        if unique_colors < 10:
-            print("⚠️  WARNING: Very low color diversity - might be permission issue!")
+        report_diversity(screenshot)
 
         # Save
-        output_dir = Path("/tmp/screenshot_tests")
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        path = output_dir / f"debug_pil_{timestamp}.png"
-        screenshot.save(path)
-        print(f"Saved to: {path}")
+        path = OUTPUT_DIR / f"debug_pil_{RUN_TIMESTAMP}.bmp"
+        save_in_background(screenshot, path)
 
         return screenshot
     except Exception as e:
@@ -75,6 +113,33 @@ def test_pil_screenshot():
         return None
 
 
+async def test_quartz_screenshot():
+    """Test the in-memory CoreGraphics capture used by the computer tool."""
+    print("\n" + "="*60)
+    print("Test 3: Quartz CGWindowListCreateImage Screenshot")
+    print("="*60)
+
+    if _load_quartz() is None:
+        print("Quartz (pyobjc) is not installed - the tool falls back to PyAutoGUI")
+        return None
+
+    try:
+        screenshot = await asyncio.to_thread(_capture_screen)
+        print(f"Screenshot size: {screenshot.size[0]}x{screenshot.size[1]}")
+
+        # Check pixel diversity
+        report_diversity(screenshot)
+
+        # Save
+        path = OUTPUT_DIR / f"debug_quartz_{RUN_TIMESTAMP}.bmp"
+        save_in_background(screenshot, path)
+
+        return screenshot
+    except Exception as e:
+        print(f"❌ Quartz screenshot failed: {e}")
+        return None
+
+
 def check_permissions():
     """Check macOS permissions."""
     print("\n" + "="*60)
@@ -95,39 +160,40 @@ def check_permissions():
     print("\n5. You may need to restart the application after granting permission")
 
 
-def test_region_screenshot():
+async def test_region_screenshot():
     """Test screenshot of a specific region."""
     print("\n" + "="*60)
-    print("Test 3: Region Screenshot (top-left 500x500)")
+    print("Test 4: Region Screenshot (top-left 500x500)")
     print("="*60)
 
     try:
-        screenshot = pyautogui.screenshot(region=(0, 0, 500, 500))
+        screenshot = await asyncio.to_thread(pyautogui.screenshot, region=(0, 0, 500, 500))
         print(f"Screenshot size: {screenshot.size[0]}x{screenshot.size[1]}")
 
         # Save
-        output_dir = Path("/tmp/screenshot_tests")
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        path = output_dir / f"debug_region_{timestamp}.png"
-        screenshot.save(path)
-        print(f"Saved to: {path}")
+        path = OUTPUT_DIR / f"debug_region_{RUN_TIMESTAMP}.bmp"
+        save_in_background(screenshot, path)
 
     except Exception as e:
         print(f"❌ Region screenshot failed: {e}")
 
 
-def main():
+async def main():
     """Run all diagnostic tests."""
     print("\n" + "#"*60)
     print("# macOS Screenshot Permission Diagnostic")
     print("#"*60)
 
     # Run tests
-    test_pyautogui_screenshot()
-    test_pil_screenshot()
-    test_region_screenshot()
+    await test_pyautogui_screenshot()
+    await test_pil_screenshot()
+    await test_quartz_screenshot()
+    await test_region_screenshot()
     check_permissions()
 
+    # Make sure every capture is on disk before pointing the user at them
+    await asyncio.gather(*pending_saves)
+
     print("\n" + "="*60)
     print("Summary")
     print("="*60)
@@ -139,4 +205,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Test script for incremental updates to the action vector index.
+Uses a small deterministic embedding model, so no model download is needed.
+"""
+
+import hashlib
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import orjson
+
+from computer_use_demo.vector_db import ActionVectorDB
+
+
+class HashEmbeddingModel:
+    """Stand-in for SentenceTransformer that embeds text by hashing it."""
+
+    dim = 8
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def _encode_one(self, text, normalize_embeddings):
+        digest = hashlib.sha256(text.encode()).digest()
+        vector = np.frombuffer(digest[: self.dim], dtype=np.uint8).astype(np.float32) + 1
+        return vector / np.linalg.norm(vector) if normalize_embeddings else vector
+
+    def encode(self, texts, normalize_embeddings=False, **kwargs):
+        if isinstance(texts, str):
+            return self._encode_one(texts, normalize_embeddings)
+        return np.stack([self._encode_one(t, normalize_embeddings) for t in texts])
+
+
+def write_log(recordings_dir: Path, name: str, request_text: str, narrative: str):
+    """Write an action log in the format ActionRecorder.process_and_save produces."""
+    recording = {
+        "session_id": datetime.now().isoformat(),
+        "recorded_at": datetime.now().isoformat(),
+        "request": {"type": "user_message", "content": {"text": request_text}},
+        "all_actions": [],
+        "successful_actions": [],
+        "narrative": narrative,
+    }
+    (recordings_dir / name).write_bytes(orjson.dumps(recording))
+
+
+def test_add_to_index_right_after_first_recording():
+    """With no saved index, adding the log that was just written must not duplicate it."""
+    with tempfile.TemporaryDirectory() as tmp:
+        recordings_dir = Path(tmp)
+        log_file = "action_log_20250101_120000.json"
+        write_log(recordings_dir, log_file, "Open Notes", "Opened Notes via Spotlight")
+
+        db = ActionVectorDB(recordings_dir=tmp, model=HashEmbeddingModel())
+        idx = db.add_to_index(
+            request_text="Open Notes",
+            narrative="Opened Notes via Spotlight",
+            log_file=log_file,
+            save=True,
+        )
+
+        assert db.index.get_n_items() == 1, db.index.get_n_items()
+        assert list(db.metadata) == [idx], db.metadata
+
+        # The saved index must not hold the duplicate either
+        reloaded = ActionVectorDB(recordings_dir=tmp, model=HashEmbeddingModel())
+        assert reloaded.load_index()
+        assert reloaded.index.get_n_items() == 1, reloaded.index.get_n_items()
+        assert len(reloaded.metadata) == 1, reloaded.metadata
+
+
+def test_add_to_index_new_recording():
+    """A log that isn't indexed yet is still added."""
+    with tempfile.TemporaryDirectory() as tmp:
+        recordings_dir = Path(tmp)
+        write_log(recordings_dir, "action_log_20250101_120000.json", "Open Notes", "Opened Notes")
+
+        db = ActionVectorDB(recordings_dir=tmp, model=HashEmbeddingModel())
+        db.ensure_index()
+
+        log_file = "action_log_20250101_130000.json"
+        write_log(recordings_dir, log_file, "Open Safari", "Opened Safari from the Dock")
+        db.add_to_index(
+            request_text="Open Safari",
+            narrative="Opened Safari from the Dock",
+            log_file=log_file,
+        )
+
+        assert db.index.get_n_items() == 2, db.index.get_n_items()
+        assert sorted(entry["log_file"] for entry in db.metadata.values()) == [
+            "action_log_20250101_120000.json",
+            log_file,
+        ]
+
+
+def main():
+    """Run all vector index tests."""
+    print("\n" + "=" * 60)
+    print("VECTOR INDEX INCREMENTAL UPDATE TEST")
+    print("=" * 60)
+
+    tests = [
+        test_add_to_index_right_after_first_recording,
+        test_add_to_index_new_recording,
+    ]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"  ✓ {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"  ✗ {test.__name__}: {e}")
+
+    print(f"\nPassed: {len(tests) - failed}/{len(tests)}")
+    return failed
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())